@@ -3,10 +3,30 @@
 """ Parser used to initialize a GPXDocument object """
 
 from xml.dom.minidom import parse
+from xml.parsers import expat
 import datetime
 import re
 
 import myPyGPX  # avoids circular imports
+import profiling
+
+# version of the parsing rules; must be incremented whenever a change in this
+# module changes the parsed data (invalidates the files of module trackcache)
+PARSER_VERSION = 2
+
+# the fields of a point that are decoded, beyond its latitude and longitude,
+# for each parse profile (see iterGPXElements()); a field that is not decoded
+# is left as if it was absent from the file
+PARSE_PROFILES = {
+    "full": ("elevation", "time", "name", "description"),
+    "laps": ("time",),   # lap splitting: distance and time
+    "track": ("elevation", "time"),  # everything a Track computes
+    "map": ()            # map rendering: coordinates only
+}
+
+# the child element of a point that holds each optional field
+FIELD_TAGS = {"ele": "elevation", "time": "time", "name": "name",
+              "description": "description"}
 
 # GPX date format(s) used for parsing. The T between date and time and Z after
 # time are allowed, too:
@@ -15,6 +35,7 @@ DATE_FORMATS = [
     '%Y-%m-%d %H:%M:%S.%f'
 ]
 
+@profiling.timed("GPXparser.parseTime")
 def parseTime(string):	
     """ Parses the date formatted as string
 
@@ -26,9 +47,14 @@ def parseTime(string):
       a native object of type datetime containing the parcels of time:
       (year, month, day, hour, minute, second, milisecond)
     """	
-     
-    if string == "":
-        result = None
+    fields = decodeTimeFields(string)
+    if fields is not None:
+        try:
+            return datetime.datetime(*fields)
+        except ValueError:
+            pass  # e.g. day 31 in a 30-day month; let strptime decide
+
+    result = None  # also when no format matches
     if 'T' in string:
         string = string.replace('T', ' ')
     if 'Z' in string:
@@ -50,6 +76,66 @@ def parseTime(string):
             pass
 
     return result
+
+def decodeTimeFields(string):
+    """ Decodes the fixed-layout date and time used by most GPX files
+
+    This is the fast path of parseTime(): the fields are sliced at known
+    positions, so no datetime is built and no exception is raised for the
+    common case of fractional seconds.
+    Requires:
+      string is a str.
+    Ensures:
+      a tuple (year, month, day, hour, minute, second, microsecond) of int
+      when string has the layout AAAA-MM-DDTHH:MM:SS[.fff]Z (optional T
+      and Z, 1 to 6 fractional digits);
+      None otherwise (e.g. a timezone offset or single digit fields), in
+      which case parseTime() must be used instead.
+    """
+    length = len(string)
+    if length < 19 or string[4] != '-' or string[7] != '-' \
+       or string[10] not in 'T ' or string[13] != ':' or string[16] != ':':
+        return None
+    if string[-1] == 'Z':
+        length -= 1
+    if length == 19:
+        microsecond = 0
+    elif 21 <= length <= 26 and string[19] == '.' \
+         and string[20:length].isdigit():
+        microsecond = int(string[20:length].ljust(6, '0'))
+    else:
+        return None
+    dateTime = string[0:4] + string[5:7] + string[8:10] \
+               + string[11:13] + string[14:16] + string[17:19]
+    if not dateTime.isdigit():
+        return None
+    return (int(dateTime[0:4]), int(dateTime[4:6]), int(dateTime[6:8]),
+            int(dateTime[8:10]), int(dateTime[10:12]), int(dateTime[12:14]),
+            microsecond)
+
+@profiling.timed("GPXparser.parseTimeFields")
+def parseTimeFields(string):
+    """ Parses the date formatted as string directly into the fields of Time
+
+    Uses decodeTimeFields() and only falls back to parseTime() for
+    the layouts the fast path does not handle.
+    Requires:
+      a string as accepted by parseTime()
+    Ensures:
+      a tuple (year, month, day, hour, minute, second) where second is a
+      float including the milliseconds, ready for myPyGPX.Time(*fields);
+      None if the string cannot be parsed.
+    """
+    fields = decodeTimeFields(string)
+    if fields is None:
+        profiling.count("GPXparser.parseTime fallbacks")
+        t = parseTime(string)
+        if t is None:
+            return None
+        fields = (t.year, t.month, t.day, t.hour, t.minute, t.second,
+                  t.microsecond)
+    (year, month, day, hour, minute, second, microsecond) = fields
+    return (year, month, day, hour, minute, second + microsecond / 1000000)
 			
 def parsePoint(point):
     """ Parses any type of point (trkpt, rtept and wpt) from the DOM model
@@ -74,9 +160,9 @@ def parsePoint(point):
     t = None
     time = None
     for e in point.getElementsByTagName("time"):
-        t = parseTime(e.childNodes[0].data.strip())
-        secMil = t.second + t.microsecond / 1000000
-        time = myPyGPX.Time(t.year, t.month, t.day, t.hour, t.minute, secMil)
+        fields = parseTimeFields(e.childNodes[0].data.strip())
+        if fields is not None:
+            time = myPyGPX.Time(*fields)
     return (lat,lon, time, ele, name, description)
 
 def buildTrack(trk):
@@ -124,9 +210,20 @@ def buildWayPointList(dom):
         waypoints.append(myPyGPX.WayPoint(lat, lon, ele, name, description))
     return waypoints
     
-def buildGPXDocument(gpxFileName, someGPXDocument):
-    """ Initializes a GPXDocument object from a GPX file
+def _countTrackPoints(gpxFileName, someGPXDocument, *otherArguments):
+    """ Returns the number of track points read into a GPXDocument """
+    track = someGPXDocument.getTrack()
+    if track is None:
+        return 0
+    return sum(len(trackSegment.getPointList())
+               for trackSegment in track.trackSegList)
+
+@profiling.timed("GPXparser.buildGPXDocumentFromDOM", _countTrackPoints)
+def buildGPXDocumentFromDOM(gpxFileName, someGPXDocument):
+    """ Initializes a GPXDocument object from a GPX file, using a DOM model
     
+    The whole file is loaded into memory before any point is processed.
+    Kept as a reference implementation; see buildGPXDocument().
     Requires:
       gpxFileName is a string that names a reachable GPX file;
       this file contains at most 1 track;
@@ -140,3 +237,178 @@ def buildGPXDocument(gpxFileName, someGPXDocument):
     for rte in dom.getElementsByTagName("rte"):
         someGPXDocument.setRoute(buildRoute(rte))       
     someGPXDocument.setWayPoints(buildWayPointList(dom))
+
+
+# ---------------------------------------------
+# Streaming parser (one point element at a time)
+# ---------------------------------------------
+
+def getProfileFields(parseProfile):
+    """ Returns the set of optional fields decoded with a parse profile
+
+    Requires:
+      parseProfile is a key of PARSE_PROFILES, or a collection of some of
+      the fields "elevation", "time", "name" and "description".
+    """
+    if isinstance(parseProfile, str):
+        parseProfile = PARSE_PROFILES[parseProfile]
+    fields = frozenset(parseProfile)
+    if not fields <= set(FIELD_TAGS.values()):
+        raise ValueError("unknown fields in parse profile: " +
+                         ", ".join(sorted(fields - set(FIELD_TAGS.values()))))
+    return fields
+
+def iterGPXElements(gpxFileName, parseProfile = "full"):
+    """ Reads a GPX file incrementally and yields its points as they end
+
+    The file is read in blocks by an expat parser, so memory use does not
+    grow with the size of the file, and no element tree is built: only the
+    attributes lat and lon of each point, and the text of the direct
+    children of the point that hold a field of parseProfile, are extracted;
+    other elements (e.g. extensions) are skipped without building any
+    object. Fields which are not decoded are left as if they were absent:
+    elevation 0, time None, name and description "".
+    Requires:
+      gpxFileName is a string that names a reachable GPX file
+      (or an open binary file object);
+      parseProfile is as for getProfileFields().
+    Ensures:
+      a generator of (tag, value) pairs, in document order:
+        ("trk", None), ("trkseg", None) and ("rte", None) when each of these
+        containers starts;
+        ("trkpt", TrackPoint), ("rtept", RoutePoint) and ("wpt", WayPoint)
+        when each point element ends.
+    """
+    fields = getProfileFields(parseProfile)
+    captureTags = dict((tag, field) for (tag, field) in FIELD_TAGS.items()
+                       if field in fields)
+    # a TrackPoint has no name or description
+    trackPointCaptureTags = dict((tag, field)
+                                 for (tag, field) in captureTags.items()
+                                 if field in ("elevation", "time"))
+    events = []  # the (tag, value) pairs found in the last block read
+    # state of the point being read (pointTag is None outside points)
+    state = {"depth": 0, "pointTag": None, "pointDepth": 0, "field": None,
+             "captureTags": captureTags}
+    values = {}
+    text = []
+
+    def startElement(name, attributes):
+        tag = name[name.rfind("}") + 1:]  # without the namespace
+        state["depth"] += 1
+        if state["pointTag"] is not None:
+            if state["depth"] == state["pointDepth"] + 1 and \
+               tag in state["captureTags"]:
+                state["field"] = state["captureTags"][tag]
+                del text[:]
+        elif tag in ("trkpt", "rtept", "wpt"):
+            state["pointTag"] = tag
+            state["pointDepth"] = state["depth"]
+            state["captureTags"] = trackPointCaptureTags if tag == "trkpt" \
+                                   else captureTags
+            values.clear()
+            values["lat"] = float(attributes["lat"])
+            values["lon"] = float(attributes["lon"])
+        elif tag in ("trk", "trkseg", "rte"):
+            events.append((tag, None))
+
+    def endElement(name):
+        depth = state["depth"]
+        state["depth"] -= 1
+        pointTag = state["pointTag"]
+        if pointTag is None:
+            return
+        if depth > state["pointDepth"]:
+            if state["field"] is not None and \
+               depth == state["pointDepth"] + 1:
+                values[state["field"]] = "".join(text).strip()
+                state["field"] = None
+            return
+        state["pointTag"] = None
+        lat = values["lat"]
+        lon = values["lon"]
+        ele = float(values["elevation"]) if "elevation" in values else 0
+        if pointTag == "trkpt":
+            time = None
+            if "time" in values:
+                timeFields = parseTimeFields(values["time"])
+                if timeFields is not None:
+                    time = myPyGPX.Time(*timeFields)
+            events.append((pointTag, myPyGPX.TrackPoint(lat, lon, time, ele)))
+        else:
+            pointClass = myPyGPX.RoutePoint if pointTag == "rtept" \
+                         else myPyGPX.WayPoint
+            events.append((pointTag,
+                           pointClass(lat, lon, ele, values.get("name", ""),
+                                      values.get("description", ""))))
+
+    def characterData(data):
+        if state["field"] is not None:
+            text.append(data)
+
+    parser = expat.ParserCreate(namespace_separator = "}")
+    parser.buffer_text = True
+    parser.StartElementHandler = startElement
+    parser.EndElementHandler = endElement
+    parser.CharacterDataHandler = characterData
+    if isinstance(gpxFileName, str):
+        gpxFile = open(gpxFileName, "rb")
+    else:
+        gpxFile = gpxFileName
+    try:
+        while True:
+            block = gpxFile.read(1 << 16)
+            parser.Parse(block, not block)
+            yield from events
+            del events[:]
+            if not block:
+                break
+    finally:
+        if gpxFile is not gpxFileName:
+            gpxFile.close()
+
+def iterTrackPoints(gpxFileName, parseProfile = "full"):
+    """ Yields the track points of a GPX file, one <trkpt> at a time
+
+    Track segment boundaries are not reported; see iterGPXElements().
+    Requires:
+      gpxFileName is a string that names a reachable GPX file;
+      parseProfile is as for iterGPXElements().
+    Ensures:
+      a generator of TrackPoint, in the order they appear in the file.
+    """
+    for (tag, value) in iterGPXElements(gpxFileName, parseProfile):
+        if tag == "trkpt":
+            yield value
+
+@profiling.timed("GPXparser.buildGPXDocument", _countTrackPoints)
+def buildGPXDocument(gpxFileName, someGPXDocument, parseProfile = "full"):
+    """ Initializes a GPXDocument object from a GPX file
+    
+    The file is read incrementally (see iterGPXElements()), so peak memory
+    stays flat as the file grows, apart from the resulting objects.
+    Only the fields of parseProfile are decoded (see PARSE_PROFILES).
+    Requires:
+      gpxFileName is a string that names a reachable GPX file;
+      this file contains at most 1 track;
+      this file contains at most 1 route;
+      parseProfile is as for iterGPXElements().
+    """
+    waypoints = []
+    for (tag, value) in iterGPXElements(gpxFileName, parseProfile):
+        if tag == "trkpt":
+            trackSeg.addPoint(value)
+        elif tag == "trkseg":
+            trackSeg = myPyGPX.TrackSeg()
+            track.addTrackSeg(trackSeg)
+        elif tag == "trk":
+            track = myPyGPX.Track()
+            someGPXDocument.setTrack(track)
+        elif tag == "rtept":
+            route.addPoint(value)
+        elif tag == "rte":
+            route = myPyGPX.Route()
+            someGPXDocument.setRoute(route)
+        else:  # tag == "wpt"
+            waypoints.append(value)
+    someGPXDocument.setWayPoints(waypoints)
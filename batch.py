@@ -0,0 +1,180 @@
+# module batch
+
+""" Batch analysis of many GPX files, spread over a pool of processes.
+
+Each GPX file is parsed and split into laps (see LapExtractor) in a worker
+process. A worker does not send back laps or track points: the laps of each
+file come back as one flat array of float, LAP_FIELDS_COUNT numbers per lap,
+which is cheap to transfer between processes.
+
+Usage from the command line:
+  python batch.py <directory or glob pattern> [<auto-lap distance in m>]
+"""
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import sys
+
+from laps import LapExtractor, LapSummary
+from myPyGPX import GPXDocument
+
+# the numbers stored for each lap, in this order (see LapSummary)
+LAP_FIELDS = ("lapNumber", "firstIndex", "lastIndex", "startingDistance",
+              "distance", "time")
+LAP_FIELDS_COUNT = len(LAP_FIELDS)
+
+
+class BatchResult:
+    """ The result of the analysis of one GPX file. """
+
+    def __init__(self, fileName, totalDistance, totalTime, lapArrays,
+                 error = None):
+        """ Creates the result of the analysis of one GPX file.
+
+        Requires:
+          fileName is the name of the analysed GPX file;
+          totalDistance (in meters) and totalTime (in seconds) are numbers,
+          or None if the file could not be analysed;
+          lapArrays is a list with, for each split spec, an array('d') with
+          LAP_FIELDS_COUNT numbers per lap (see LAP_FIELDS);
+          error is None, or a string describing why the analysis failed.
+        """
+        self.fileName = fileName
+        self.totalDistance = totalDistance
+        self.totalTime = totalTime
+        self.lapArrays = lapArrays
+        self.error = error
+
+    def getFileName(self):
+        return self.fileName
+
+    def getError(self):
+        return self.error
+
+    def getLapCount(self, specIndex = 0):
+        """ Returns the number of laps obtained with the given split spec """
+        return len(self.lapArrays[specIndex]) // LAP_FIELDS_COUNT
+
+    def getLapSummaries(self, specIndex = 0):
+        """ Returns the laps obtained with the given split spec.
+
+        Ensures: a list of LapSummary (see LapExtractor.getLapSummaries()).
+        """
+        lapArray = self.lapArrays[specIndex]
+        result = []
+        for i in range(0, len(lapArray), LAP_FIELDS_COUNT):
+            (lapNumber, firstIndex, lastIndex, startingDistance, distance,
+             time) = lapArray[i:i + LAP_FIELDS_COUNT]
+            result.append(LapSummary(int(lapNumber), int(firstIndex),
+                                     int(lastIndex), startingDistance,
+                                     distance, time))
+        return result
+
+
+def findGPXFiles(directoryOrPattern):
+    """ Returns the sorted list of the GPX files to analyse.
+
+    Requires: directoryOrPattern is the name of a directory (all of its .gpx
+      files are taken) or a glob pattern (e.g. "activities/2019-*.gpx").
+    """
+    if os.path.isdir(directoryOrPattern):
+        directoryOrPattern = os.path.join(directoryOrPattern, "*.gpx")
+    return sorted(glob.glob(directoryOrPattern))
+
+
+def getAvailableCores():
+    """ Returns the number of cores this process may run on """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on every platform
+        return os.cpu_count() or 1
+
+
+def analyseFile(gpxFileName, listOfSplitSpecs, cacheDirectory = None):
+    """ Parses one GPX file and splits its track into laps.
+
+    Requires:
+      listOfSplitSpecs is as for LapExtractor.getLapSummaries();
+      cacheDirectory is as for GPXDocument().
+    Ensures: a BatchResult; if the file cannot be analysed (e.g. it cannot
+      be read, has no track, or has track points without time), its error
+      describes why and it has no laps.
+    """
+    try:
+        # only distance and time are needed (see GPXparser.PARSE_PROFILES)
+        track = GPXDocument(gpxFileName, cacheDirectory, "laps").getTrack()
+        lapArrays = []
+        for listOfSummaries in \
+          LapExtractor(track).getLapSummaries(listOfSplitSpecs):
+            lapArray = array('d')
+            for lap in listOfSummaries:
+                (firstIndex, lastIndex) = lap.getIndexRange()
+                lapArray.extend((lap.getLapNumber(), firstIndex, lastIndex,
+                                 lap.getStartingDistance(),
+                                 lap.totalDistance(), lap.totalTime()))
+            lapArrays.append(lapArray)
+        return BatchResult(gpxFileName, track.totalDistance(),
+                           track.totalTime(), lapArrays)
+    except Exception as exception:
+        return BatchResult(gpxFileName, None, None, [],
+                           type(exception).__name__ + ": " + str(exception))
+
+
+def _analyseFileTask(task):
+    """ Runs analyseFile() in a worker; task is a tuple of its arguments """
+    return analyseFile(*task)
+
+
+def analyseFiles(directoryOrPattern, listOfSplitSpecs = None,
+                 numberOfProcesses = None, cacheDirectory = None):
+    """ Analyses all the GPX files of a directory, in parallel.
+
+    Each file is analysed by analyseFile() in one of numberOfProcesses worker
+    processes; files are handed out in small chunks, so that workers which
+    get short files are not left idle.
+    Requires:
+      directoryOrPattern is as for findGPXFiles();
+      listOfSplitSpecs is None (laps of 998.03 m) or as for
+      LapExtractor.getLapSummaries();
+      numberOfProcesses is None (as many as available cores) or a positive
+      int; with 1, everything runs in the calling process;
+      cacheDirectory is as for GPXDocument().
+    Ensures: a list with the BatchResult of each file, in the order of
+      findGPXFiles().
+    """
+    if listOfSplitSpecs is None:
+        listOfSplitSpecs = [("distance", 998.03)]
+    listOfFileNames = findGPXFiles(directoryOrPattern)
+    tasks = [(fileName, listOfSplitSpecs, cacheDirectory)
+             for fileName in listOfFileNames]
+    if numberOfProcesses is None:
+        numberOfProcesses = getAvailableCores()
+    numberOfProcesses = min(numberOfProcesses, len(tasks))
+    if numberOfProcesses <= 1:
+        return [_analyseFileTask(task) for task in tasks]
+    chunkSize = max(1, len(tasks) // (numberOfProcesses * 4))
+    with ProcessPoolExecutor(numberOfProcesses) as executor:
+        return list(executor.map(_analyseFileTask, tasks,
+                                 chunksize = chunkSize))
+
+
+if __name__ == "__main__":
+    from myPyGPX import Analyse
+    if len(sys.argv) < 2:
+        print("Usage: python batch.py <directory or glob pattern>"
+              " [<auto-lap distance in m>]")
+        sys.exit(1)
+    autoSplitValue = float(sys.argv[2]) if len(sys.argv) > 2 else 998.03
+    for result in analyseFiles(sys.argv[1], [("distance", autoSplitValue)]):
+        print("\n" + result.getFileName())
+        if result.getError() is not None:
+            print("  Error:", result.getError())
+            continue
+        print("  Total Distance =", "{:.1f}".format(result.totalDistance), "m")
+        print("  Total Time =", Analyse.secondsToHoursMinSec(result.totalTime))
+        for lap in result.getLapSummaries():
+            print("  ", str(lap.getLapNumber()).zfill(3), " ",
+                  Analyse.paceDecimalMinutesToMinSec(
+                    lap.averageSpeed(expressAs = "pace")))
@@ -0,0 +1,343 @@
+# module benchmark
+
+""" Benchmark suite: times each stage of the processing of GPX files.
+
+For each GPX file bundled with the project, and for synthetic tracks made by
+repeating MaratonaAveiro2019.gpx (10 and 100 times a marathon), each stage
+is timed separately: parsing (GPXparser.buildGPXDocument, also with the
+"laps" parse profile, and parseTime), the derived attributes of Track,
+produceSeries, filterSeries, and every method of LapExtractor (including
+_split). Each stage is run several times (the
+setup it needs, e.g. a fresh track, is not timed) and then once more to
+measure its peak memory with tracemalloc.
+The results are saved as JSON, so that runs (e.g. before and after a change
+to an engine) can be compared with --compare.
+
+Usage:
+  python benchmark.py [--scales 1,10,100] [--repeat 5]
+                      [--output benchmark_results.json] [--compare old.json]
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+
+import GPXparser
+import kernels
+from laps import LapExtractor, LapTracker
+from myPyGPX import Analyse, GPXDocument
+
+# the directory of the project, where the bundled files are
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# in PROJECT_DIRECTORY
+BUNDLED_FILES = ["WendoverMarathon2.gpx",
+                 "FR935-25_04_2018_dois_trksegs_com_waypoints.gpx",
+                 "MaratonaAveiro2019.gpx"]
+
+# the file repeated to make the synthetic tracks (in PROJECT_DIRECTORY)
+SYNTHETIC_SOURCE = "MaratonaAveiro2019.gpx"
+
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_REPEAT = 5
+DEFAULT_OUTPUT = "benchmark_results.json"
+
+
+def measure(run, setup = None, repeat = DEFAULT_REPEAT):
+    """ Times a stage, and measures its peak memory.
+
+    Requires:
+      run is a function of one argument, the stage to measure;
+      setup is None or a function with no arguments, whose result is given
+      to run (None if there is no setup); it is called before each run and
+      is not measured;
+      repeat is a positive int.
+    Ensures: a dict with "best" and "median" (seconds over repeat runs),
+      "repeat", and "peakMemory" (bytes allocated at the peak of one more
+      run, traced by tracemalloc, not counting the setup).
+    """
+    times = []
+    for i in range(repeat):
+        state = setup() if setup is not None else None
+        gc.collect()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+        del state
+    times.sort()
+    state = setup() if setup is not None else None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        run(state)
+        peakMemory = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return {"best": times[0], "median": times[len(times) // 2],
+            "repeat": repeat, "peakMemory": peakMemory}
+
+
+def _readTimeStrings(gpxFileName):
+    """ Returns the list of the <time> texts of the track points of a file """
+    result = []
+    for (event, element) in ElementTree.iterparse(gpxFileName):
+        if element.tag.endswith("}time") or element.tag == "time":
+            result.append(element.text)
+    return result
+
+
+def _freshTrack(gpxFileName):
+    """ Returns the track of a newly read GPXDocument """
+    return GPXDocument(gpxFileName).getTrack()
+
+
+def _forgetDerivedMetrics(track):
+    """ Makes track compute its derived attributes and series again """
+    track._memoKey = None
+    return track
+
+
+def getStages(gpxFileName):
+    """ Returns the stages to measure for one GPX file.
+
+    Ensures: a list of triples (stage name, run, setup), as for measure().
+    The track is read once here, and each stage that uses it starts from
+    the state it needs (e.g. derived attributes forgotten or computed).
+    """
+    track = _freshTrack(gpxFileName)
+    track._ensureComputed("accumulatedDistance")
+    hasTime = "speed" in track._getMemo()
+    timeStrings = _readTimeStrings(gpxFileName)
+
+    def forgotten():
+        return _forgetDerivedMetrics(track)
+
+    def computed():
+        _forgetDerivedMetrics(track)._ensureComputed("accumulatedDistance")
+        return track
+
+    stages = [
+      ("GPXparser.buildGPXDocument",
+       lambda state: GPXDocument(gpxFileName), None),
+      ("GPXparser.buildGPXDocument laps profile",
+       lambda state: GPXDocument(gpxFileName, parseProfile = "laps"), None),
+      ("GPXparser.iterTrackPoints",
+       lambda state: sum(1 for trackPoint in
+                         GPXparser.iterTrackPoints(gpxFileName)), None),
+      ("GPXparser.parseTime",
+       lambda state: [GPXparser.parseTime(string) for string in timeStrings],
+       None),
+      ("Track._computeAccDistanceForEachTrackPoint",
+       lambda track: track._computeAccDistanceForEachTrackPoint(), forgotten),
+      ("Track._computeAccElevationForEachTrackPoint",
+       lambda track: track._computeAccElevationForEachTrackPoint(), forgotten),
+      ("Track._computeDerivedAttributesForEachTrackPoint",
+       lambda track: track._computeDerivedAttributesForEachTrackPoint(),
+       forgotten),
+      ("Track.getSerialized", lambda track: track.getSerialized(), computed),
+      ("Track.produceSeries distance elevation",
+       lambda track: track.produceSeries("distance series", "elevation"),
+       computed)]
+    if not hasTime:  # the remaining stages need the time of each point
+        return stages
+    series = track.produceSeries("distance series", "pace")
+    totalDistance = track.totalDistance()
+    totalTime = track.totalTime()
+    # every 1000 m and 300 s; the last marker is beyond the end of the track
+    distanceMarkers = [1000.0 * k
+                       for k in range(1, int(totalDistance / 1000) + 2)]
+    timeMarkers = [300.0 * k for k in range(1, int(totalTime / 300) + 2)]
+    serializedTrack = track.getSerialized()
+
+    def extractor():
+        return LapExtractor(track)
+
+    def extractorAndSplitIndices():
+        lapExtractor = LapExtractor(track)
+        return (lapExtractor, lapExtractor._splitIndicesByDistance(998.03))
+
+    stages += [
+      ("Track._computeSpeedForEachTrackPoint",
+       lambda track: track._computeSpeedForEachTrackPoint(), forgotten),
+      ("Track.produceSeries distance pace",
+       lambda track: track.produceSeries("distance series", "pace"),
+       computed),
+      ("Track.produceSeries time pace",
+       lambda track: track.produceSeries("time series", "pace"), computed)]
+    for (filterKind, nForAverage) in [("running average", 5),
+                                      ("running average", 50),
+                                      ("centered average", 5),
+                                      ("exponential", 5), ("median", 5)]:
+        stages.append(("Analyse.filterSeries " + filterKind + " " +
+                       str(nForAverage),
+                       lambda state, filterKind = filterKind,
+                              nForAverage = nForAverage:
+                         Analyse.filterSeries(series, nForAverage, filterKind),
+                       None))
+    stages += [
+      ("LapExtractor.__init__", lambda state: LapExtractor(track), None),
+      ("LapExtractor.getAutoLapsByDistance",
+       lambda extractor: extractor.getAutoLapsByDistance(), extractor),
+      ("LapExtractor.getAutoLapsByTime",
+       lambda extractor: extractor.getAutoLapsByTime(), extractor),
+      ("LapExtractor.getLapsFromListOfDistanceMarkers",
+       lambda extractor:
+         extractor.getLapsFromListOfDistanceMarkers(distanceMarkers),
+       extractor),
+      ("LapExtractor.getLapsFromListOfTimeMarkers",
+       lambda extractor: extractor.getLapsFromListOfTimeMarkers(timeMarkers),
+       extractor),
+      ("LapExtractor.getLapSummaries",
+       lambda extractor: extractor.getLapSummaries(
+         [("distance", 998.03), ("time", 240.0),
+          ("distance markers", distanceMarkers),
+          ("time markers", timeMarkers)]), extractor),
+      ("LapExtractor._split",
+       lambda pair: pair[0]._split(pair[1]), extractorAndSplitIndices),
+      ("Lap.totalDistance of all laps",
+       lambda laps: [lap.totalDistance() for lap in laps],
+       lambda: extractor().getAutoLapsByDistance()),
+      ("LapTracker.feed distance",
+       lambda state: list(LapTracker("distance", 998.03)
+                          .feed(serializedTrack)), None)]
+    return stages
+
+
+def _formatTime(epochMicroseconds):
+    """ Returns the GPX text of a time given as Time.epochMicroseconds """
+    moment = datetime(1970, 1, 1) + timedelta(microseconds = epochMicroseconds)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S") + \
+           ".%03dZ" % (moment.microsecond // 1000)
+
+
+def writeSyntheticGPX(sourceFileName, copies, outputFileName):
+    """ Writes a GPX file whose track repeats that of another file.
+
+    The track of the new file has one track segment per copy of the track
+    points of the source file; each copy starts one second after the end of
+    the previous one.
+    Requires: every track point of the source file has a time.
+    """
+    points = list(GPXparser.iterTrackPoints(sourceFileName))
+    start = points[0].getTime().epochMicroseconds
+    span = points[-1].getTime().epochMicroseconds - start + 1000000
+    with open(outputFileName, "w", encoding = "utf-8") as gpxFile:
+        gpxFile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<gpx version="1.1" creator="benchmark"'
+                      ' xmlns="http://www.topografix.com/GPX/1/1">\n'
+                      '  <trk>\n    <name>synthetic</name>\n')
+        for copy in range(copies):
+            gpxFile.write("    <trkseg>\n")
+            for trackPoint in points:
+                gpxFile.write(
+                  '      <trkpt lat="%r" lon="%r">\n'
+                  '        <ele>%r</ele>\n'
+                  '        <time>%s</time>\n'
+                  '      </trkpt>\n' % (trackPoint.getLatitude(),
+                    trackPoint.getLongitude(), trackPoint.getElevation(),
+                    _formatTime(trackPoint.getTime().epochMicroseconds
+                                + copy * span)))
+            gpxFile.write("    </trkseg>\n")
+        gpxFile.write("  </trk>\n</gpx>\n")
+
+
+def benchmarkFile(gpxFileName, label, repeat = DEFAULT_REPEAT):
+    """ Measures all the stages for one GPX file.
+
+    Ensures: a list with a dict for each stage (see measure()), also with
+      "file" (label), "points" (number of track points) and "stage"; a
+      stage that fails has "error" instead of its measurements.
+    """
+    numberOfPoints = sum(1 for trackPoint in
+                         GPXparser.iterTrackPoints(gpxFileName))
+    results = []
+    for (stage, run, setup) in getStages(gpxFileName):
+        result = {"file": label, "points": numberOfPoints, "stage": stage}
+        try:
+            result.update(measure(run, setup, repeat))
+        except Exception as exception:
+            result["error"] = type(exception).__name__ + ": " + str(exception)
+        print("  {:<52} {}".format(stage, "{:10.4f} s".format(result["best"])
+                                   if "best" in result else result["error"]))
+        results.append(result)
+    return results
+
+
+def runBenchmarks(scales = DEFAULT_SCALES, repeat = DEFAULT_REPEAT):
+    """ Measures the bundled files and the synthetic tracks.
+
+    Each scale s > 1 is a synthetic track with s copies of
+    SYNTHETIC_SOURCE, measured with repeat // s runs (at least 1).
+    Ensures: a dict, ready to be saved as JSON, with the environment of the
+      run and the list of the results of benchmarkFile().
+    """
+    results = []
+    for scale in scales:
+        if scale == 1:
+            for gpxFileName in BUNDLED_FILES:
+                print(gpxFileName)
+                results += benchmarkFile(
+                  os.path.join(PROJECT_DIRECTORY, gpxFileName), gpxFileName,
+                  repeat)
+            continue
+        label = "synthetic x" + str(scale)
+        print(label)
+        (fileDescriptor, gpxFileName) = tempfile.mkstemp(suffix = ".gpx")
+        os.close(fileDescriptor)
+        try:
+            writeSyntheticGPX(os.path.join(PROJECT_DIRECTORY,
+                                           SYNTHETIC_SOURCE),
+                              scale, gpxFileName)
+            results += benchmarkFile(gpxFileName, label,
+                                     max(1, repeat // scale))
+        finally:
+            os.remove(gpxFileName)
+    return {"created": datetime.now().isoformat(timespec = "seconds"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "numpy": kernels.numpy.__version__
+                     if kernels.numpy is not None else None,
+            "results": results}
+
+
+def compareResults(oldRun, newRun):
+    """ Prints the ratio new/old of the best time of each common stage """
+    oldTimes = dict(((result["file"], result["stage"]), result["best"])
+                    for result in oldRun["results"] if "best" in result)
+    for result in newRun["results"]:
+        key = (result["file"], result["stage"])
+        if "best" in result and key in oldTimes and oldTimes[key] > 0:
+            print("{:<28} {:<52} {:6.2f}x".format(result["file"][:28],
+                  result["stage"], result["best"] / oldTimes[key]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark suite")
+    parser.add_argument("--scales", default = ",".join(map(str,
+                                                           DEFAULT_SCALES)),
+                        help = "comma-separated track sizes, in marathons "
+                               "(1 = the bundled files)")
+    parser.add_argument("--repeat", type = int, default = DEFAULT_REPEAT)
+    parser.add_argument("--output", default = DEFAULT_OUTPUT)
+    parser.add_argument("--compare", default = None,
+                        help = "JSON file of a previous run")
+    arguments = parser.parse_args()
+    run = runBenchmarks([int(scale) for scale in arguments.scales.split(",")],
+                        arguments.repeat)
+    with open(arguments.output, "w") as outputFile:
+        json.dump(run, outputFile, indent = 1)
+    print("Results saved in", arguments.output)
+    if arguments.compare is not None:
+        with open(arguments.compare) as oldFile:
+            compareResults(json.load(oldFile), run)
+    sys.exit(0)
@@ -0,0 +1,80 @@
+# module check startup
+
+""" Measures how long the core modules take to import, and guards it.
+
+Each measurement runs in a new Python process (a cold start, as for a batch
+worker), and the best of several runs is kept. The check fails if a core
+module imports the plotting backend (matplotlib), or if the start-up time
+exceeds a budget.
+
+Usage: python check_startup.py [<budget in seconds>]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# the directory of the project, from which the modules are imported
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# modules that must import without the plotting backend
+CORE_MODULES = ["GPXparser", "kernels", "myPyGPX", "laps", "batch",
+                "trackcache"]
+
+# default budget for importing all of CORE_MODULES, in seconds
+DEFAULT_BUDGET = 0.5
+
+NUMBER_OF_RUNS = 5
+
+# runs in the new process: imports the modules and reports the time taken
+# and the plotting modules that got imported
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+for name in %r:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed,
+                  "plotting": sorted(name for name in sys.modules
+                                     if name.split(".")[0] in
+                                     ("matplotlib", "pylab"))}))
+"""
+
+
+def measureStartup(moduleNames = CORE_MODULES, numberOfRuns = NUMBER_OF_RUNS):
+    """ Measures the time to import some modules in a new process.
+
+    Requires: moduleNames is a list of names of modules of this project.
+    Ensures: a pair (best time in seconds over numberOfRuns runs, sorted list
+      of the plotting modules imported along with them).
+    """
+    bestTime = None
+    plottingModules = []
+    for run in range(numberOfRuns):
+        output = subprocess.run([sys.executable, "-c", _MEASURE % moduleNames],
+                                check = True, capture_output = True,
+                                text = True, cwd = PROJECT_DIRECTORY).stdout
+        measurement = json.loads(output)
+        if bestTime is None or measurement["seconds"] < bestTime:
+            bestTime = measurement["seconds"]
+        plottingModules = measurement["plotting"]
+    return (bestTime, plottingModules)
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET
+    (seconds, plottingModules) = measureStartup()
+    print("Start-up time of", ", ".join(CORE_MODULES), "=",
+          "{:.3f}".format(seconds), "s (budget", budget, "s)")
+    failed = False
+    if plottingModules:
+        print("FAILED: the plotting backend was imported:",
+              ", ".join(plottingModules[:5]))
+        failed = True
+    if seconds > budget:
+        print("FAILED: start-up time exceeds the budget")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
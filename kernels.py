@@ -0,0 +1,394 @@
+# module kernels
+
+""" Batched numeric kernels over whole columns of track point data.
+
+Each kernel takes whole sequences (one value per point) instead of Point
+objects. NumPy is used when it is available; otherwise an equivalent loop in
+pure Python is used. Either way, a kernel returns a sequence of float that
+supports len(), indexing and tolist() (a numpy array, or an array('d')).
+The distance model is the one of myPyGPX.Point.distance().
+"""
+
+from array import array
+from math import pi, cos, sqrt, floor
+
+import profiling
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional
+    numpy = None
+
+# version of the distance model; must be incremented whenever a change in this
+# module changes the computed values (invalidates the files of trackcache)
+DISTANCE_MODEL_VERSION = 1
+
+
+def _distanceNumpy(lat, lon, otherLat, otherLon):
+    """ Point.distance() between arrays of points (NumPy version) """
+    latMid = (lat + otherLat)/2           # decimal degrees
+    latMid = 2 * numpy.pi * latMid / 360  # radians
+    meterPerDegreeLat = 111132.92 - 559.82 * numpy.cos(2 * latMid) \
+                           + 1.175 * numpy.cos(4 * latMid) \
+                           - 0.0023 * numpy.cos(6 * latMid)
+    meterPerDegreeLon = 111412.84 * numpy.cos(latMid) \
+                           - 93.5 * numpy.cos(3 * latMid) \
+                           + 0.118 * numpy.cos(5 * latMid)
+    deltaLat = numpy.abs(otherLat - lat)
+    deltaLon = numpy.abs(otherLon - lon)
+    return numpy.sqrt((deltaLat * meterPerDegreeLat)**2 +
+                      (deltaLon * meterPerDegreeLon)**2)
+
+
+def _distance(lat, lon, otherLat, otherLon):
+    """ Point.distance() between two points given by their coordinates """
+    latMid = (lat + otherLat)/2     # decimal degrees
+    latMid = 2 * pi * latMid / 360  # radians
+    meterPerDegreeLat = 111132.92 - 559.82 * cos(2 * latMid) \
+                           + 1.175 * cos(4 * latMid) \
+                           - 0.0023 * cos(6 * latMid)
+    meterPerDegreeLon = 111412.84 * cos(latMid) \
+                           - 93.5 * cos(3 * latMid) \
+                           + 0.118 * cos(5 * latMid)
+    deltaLat = abs(otherLat - lat)
+    deltaLon = abs(otherLon - lon)
+    return sqrt((deltaLat * meterPerDegreeLat)**2 +
+                (deltaLon * meterPerDegreeLon)**2)
+
+
+def _numberOfPoints(lat, *arguments, **keywordArguments):
+    """ Returns the number of points given to a kernel (see profiling) """
+    return len(lat)
+
+
+@profiling.timed("kernels.consecutiveDistances", _numberOfPoints)
+def consecutiveDistances(lat, lon):
+    """ Computes the distance from each point to the previous one.
+
+    Requires:
+      lat and lon are sequences of float with the same length n, holding the
+      coordinates of n consecutive points in decimal degrees.
+    Ensures:
+      a pair (stepDistance, accumulatedDistance) of sequences of length n,
+      in meters, where
+        stepDistance[0] = 0 and stepDistance[i] is the distance from point
+        i-1 to point i;
+        accumulatedDistance[i] is the sum of stepDistance[0..i], summed in
+        order, as Track does.
+    """
+    n = len(lat)
+    if numpy is not None:
+        lat = numpy.asarray(lat, dtype = numpy.float64)
+        lon = numpy.asarray(lon, dtype = numpy.float64)
+        stepDistance = numpy.zeros(n)
+        if n > 1:
+            stepDistance[1:] = _distanceNumpy(lat[1:], lon[1:],
+                                              lat[:-1], lon[:-1])
+        return (stepDistance, numpy.cumsum(stepDistance))
+    stepDistance = array('d', [0.0]) * n
+    accumulatedDistance = array('d', [0.0]) * n
+    for i in range(1, n):
+        stepDistance[i] = _distance(lat[i], lon[i], lat[i-1], lon[i-1])
+        accumulatedDistance[i] = accumulatedDistance[i-1] + stepDistance[i]
+    return (stepDistance, accumulatedDistance)
+
+
+@profiling.timed("kernels.distancesToPoint", _numberOfPoints)
+def distancesToPoint(lat, lon, centerLat, centerLon):
+    """ Computes the distance from each point to a single reference point.
+
+    Requires:
+      lat and lon are sequences of float with the same length n;
+      centerLat and centerLon are float.
+    Ensures:
+      a sequence of n distances in meters.
+    """
+    if numpy is not None:
+        return _distanceNumpy(numpy.asarray(lat, dtype = numpy.float64),
+                              numpy.asarray(lon, dtype = numpy.float64),
+                              centerLat, centerLon)
+    return array('d', [_distance(lat[i], lon[i], centerLat, centerLon)
+                       for i in range(len(lat))])
+
+
+# lower bounds of the meters per degree of the distance model, at any
+# latitude (for the longitude, per unit of cos(latitude)), so that the
+# bounding box of a zone computed with them contains the whole zone
+METERS_PER_DEGREE_LAT_LOWER_BOUND = 110000.0
+METERS_PER_DEGREE_LON_LOWER_BOUND = 111000.0
+
+
+def _zoneBoundingBox(centerLat, centerLon, radius):
+    """ Returns (minLat, maxLat, minLon, maxLon) enclosing a circular zone """
+    halfLat = radius / METERS_PER_DEGREE_LAT_LOWER_BOUND
+    cosine = cos(min(abs(centerLat) + halfLat, 90.0) * pi / 180)
+    if cosine * METERS_PER_DEGREE_LON_LOWER_BOUND * 360.0 > radius:
+        halfLon = radius / (METERS_PER_DEGREE_LON_LOWER_BOUND * cosine)
+    else:  # near a pole: every longitude
+        halfLon = 360.0
+    return (centerLat - halfLat, centerLat + halfLat,
+            centerLon - halfLon, centerLon + halfLon)
+
+
+@profiling.timed("kernels.pointsInZones", _numberOfPoints)
+def pointsInZones(lat, lon, zones):
+    """ Finds the points that lie within any of several circular zones.
+
+    A point is within a zone if its distance to the center of the zone is
+    at most the radius of the zone, as in Track.hidePartOfTrack(). Instead
+    of computing the distance from every point to every zone, the zones are
+    hashed into a grid of cells as large as the largest zone's bounding box;
+    the distance is only computed for the points found in the bounding box
+    of a zone of their cell (with distancesToPoint(), once per zone).
+    Requires:
+      lat and lon are sequences of float with the same length n;
+      zones is a list of triples (centerLat, centerLon, radius), with the
+      center in decimal degrees and a non-negative radius in meters.
+    Ensures:
+      a list of n bool, True for the points within some zone.
+    """
+    n = len(lat)
+    inside = [False] * n
+    if not zones:
+        return inside
+    if hasattr(lat, "tolist"):  # NumPy arrays: faster to read as lists
+        lat = lat.tolist()
+        lon = lon.tolist()
+    boxes = [_zoneBoundingBox(*zone) for zone in zones]
+    # cells are at least as large as any box, so a box overlaps <= 4 cells
+    cellLat = max([box[1] - box[0] for box in boxes]) or 1e-9
+    cellLon = max([box[3] - box[2] for box in boxes]) or 1e-9
+    grid = {}
+    for k, (minLat, maxLat, minLon, maxLon) in enumerate(boxes):
+        for i in range(floor(minLat / cellLat), floor(maxLat / cellLat) + 1):
+            for j in range(floor(minLon / cellLon),
+                           floor(maxLon / cellLon) + 1):
+                grid.setdefault((i, j), []).append(k)
+    candidates = [[] for zone in zones]
+    for index in range(n):
+        pointLat = lat[index]
+        pointLon = lon[index]
+        for k in grid.get((floor(pointLat / cellLat),
+                           floor(pointLon / cellLon)), ()):
+            (minLat, maxLat, minLon, maxLon) = boxes[k]
+            if minLat <= pointLat <= maxLat and minLon <= pointLon <= maxLon:
+                candidates[k].append(index)
+    for k, (centerLat, centerLon, radius) in enumerate(zones):
+        indices = candidates[k]
+        if indices:
+            distanceToCenter = distancesToPoint([lat[i] for i in indices],
+                                                [lon[i] for i in indices],
+                                                centerLat, centerLon)
+            for index, distance in zip(indices, distanceToCenter):
+                if distance <= radius:
+                    inside[index] = True
+    return inside
+
+
+@profiling.timed("kernels.speeds", _numberOfPoints)
+def speeds(stepDistance, times, timeUnit = 1):
+    """ Computes the instant speed at each point, in m/s.
+
+    Times may be given in seconds, or as integers in a smaller unit (e.g.
+    Time.epochMicroseconds with timeUnit = 1000000), in which case the
+    differences between consecutive times are exact before being converted
+    to seconds, as in Time.timeInterval().
+    Requires:
+      stepDistance is as returned by consecutiveDistances(), with n >= 2;
+      times is a sequence of n times, each in seconds * timeUnit.
+    Ensures:
+      a sequence of n speeds where speed[i] is stepDistance[i] divided by the
+      time from point i-1 to point i, and speed[0] = speed[1] by convention.
+    Raises ZeroDivisionError if two consecutive times are equal, with or
+    without NumPy (as Track did before these kernels).
+    """
+    n = len(stepDistance)
+    if numpy is not None:
+        timeStep = numpy.diff(numpy.asarray(times)) / timeUnit
+        if (timeStep == 0).any():
+            raise ZeroDivisionError("two consecutive points have the same "
+                                    "time")
+        speed = numpy.empty(n)
+        speed[1:] = numpy.asarray(stepDistance)[1:] / timeStep
+        speed[0] = speed[1]
+        return speed
+    speed = array('d', [0.0]) * n
+    for i in range(1, n):
+        timeStep = (times[i] - times[i-1]) / timeUnit
+        if timeStep == 0:
+            raise ZeroDivisionError("two consecutive points have the same "
+                                    "time")
+        speed[i] = stepDistance[i] / timeStep
+    speed[0] = speed[1]
+    return speed
+
+
+def seriesStatistics(values, percentiles = ()):
+    """ Computes summary statistics of a sequence of values in one pass.
+
+    Requires:
+      values is a non-empty sequence of float;
+      percentiles is a sequence of numbers between 0 and 100.
+    Ensures:
+      a dict with
+        "minimumIndex" and "maximumIndex": the index of the first occurrence
+          of the minimum and of the maximum value;
+        "mean" and "standardDeviation" (population standard deviation);
+        "percentiles": a list with the value at each of the given
+          percentiles, linearly interpolated between the closest values
+          (the default method of numpy.percentile).
+      All numbers are int or float (not NumPy scalars).
+    """
+    if numpy is not None:
+        values = numpy.asarray(values, dtype = numpy.float64)
+        return {"minimumIndex": int(numpy.argmin(values)),
+                "maximumIndex": int(numpy.argmax(values)),
+                "mean": float(numpy.mean(values)),
+                "standardDeviation": float(numpy.std(values)),
+                "percentiles": numpy.percentile(values,
+                                                list(percentiles)).tolist()
+                               if len(percentiles) > 0 else []}
+    minimumIndex = 0
+    maximumIndex = 0
+    for i in range(1, len(values)):
+        if values[i] < values[minimumIndex]:
+            minimumIndex = i
+        elif values[i] > values[maximumIndex]:
+            maximumIndex = i
+    mean = sum(values) / len(values)
+    variance = sum([(value - mean)**2 for value in values]) / len(values)
+    result = []
+    if len(percentiles) > 0:
+        sortedValues = sorted(values)
+        for percentile in percentiles:
+            position = (len(values) - 1) * percentile / 100
+            below = int(position)
+            above = min(below + 1, len(values) - 1)
+            result.append(sortedValues[below] + (position - below) *
+                          (sortedValues[above] - sortedValues[below]))
+    return {"minimumIndex": minimumIndex, "maximumIndex": maximumIndex,
+            "mean": mean, "standardDeviation": sqrt(variance),
+            "percentiles": result}
+
+
+@profiling.timed("kernels.derivedMetrics", _numberOfPoints)
+def derivedMetrics(lat, lon, elevation, times = None, timeUnit = 1):
+    """ Computes all the derived attributes of consecutive points at once.
+
+    Fuses consecutiveDistances(), the accumulated ascent and speeds(): the
+    distance between each pair of consecutive points is computed only once.
+    Requires:
+      lat, lon and elevation are sequences of n float (n >= 1);
+      times is None, or as for speeds() (then n >= 2).
+    Ensures:
+      a tuple (accumulatedDistance, accumulatedElevation, speed) of
+      sequences of n float, equal to those of consecutiveDistances(),
+      Track._computeAccElevationForEachTrackPoint() and speeds();
+      speed is None when times is None, or when speeds() would raise
+      ZeroDivisionError (two consecutive times are equal).
+    """
+    (stepDistance, accumulatedDistance) = consecutiveDistances(lat, lon)
+    n = len(stepDistance)
+    if numpy is not None:
+        stepAscent = numpy.zeros(n)
+        if n > 1:
+            stepAscent[1:] = numpy.maximum(
+              numpy.diff(numpy.asarray(elevation, dtype = numpy.float64)), 0)
+        accumulatedElevation = numpy.cumsum(stepAscent)
+    else:
+        accumulatedElevation = array('d', [0.0]) * n
+        for i in range(1, n):
+            verticalDistanceFromPrevious = elevation[i] - elevation[i-1]
+            if verticalDistanceFromPrevious < 0:
+                verticalDistanceFromPrevious = 0
+            accumulatedElevation[i] = accumulatedElevation[i-1] + \
+                                      verticalDistanceFromPrevious
+    speed = None
+    if times is not None:
+        try:
+            speed = speeds(stepDistance, times, timeUnit)
+        except ZeroDivisionError:  # the speed of some point is undefined
+            speed = None
+    return (accumulatedDistance, accumulatedElevation, speed)
+
+
+def isNonDecreasing(values):
+    """ True if each value is >= the previous one (e.g. the x of a time or
+    distance series, but usually not the longitudes of a route) """
+    if numpy is not None:
+        return bool(numpy.all(numpy.diff(numpy.asarray(values,
+                                                       dtype = numpy.float64))
+                              >= 0))
+    return all(values[i-1] <= values[i] for i in range(1, len(values)))
+
+
+def decimationIndices(x, y, maximumPoints, method = "min max"):
+    """ Chooses which points of a series to keep so that it can be drawn.
+
+    The shape of the series is preserved as seen in a plot: the first and
+    last points are always kept, and the points in between are split into
+    buckets of consecutive points, of which
+      "min max": the points with the smallest and largest y of each bucket
+        are kept, so that every peak and valley is drawn;
+      "lttb" (Largest-Triangle-Three-Buckets): one point of each bucket is
+        kept, the one forming the largest triangle with the point kept in
+        the previous bucket and the average of the next bucket.
+    Requires:
+      x and y are sequences of n float (x non-decreasing);
+      maximumPoints is an int >= 4;
+      method = "min max" or "lttb".
+    Ensures:
+      an increasing list of at most maximumPoints indices of points of the
+      series; all indices if n <= maximumPoints.
+    """
+    n = len(y)
+    if n <= maximumPoints:
+        return list(range(n))
+    if numpy is not None:
+        x = numpy.asarray(x, dtype = numpy.float64)
+        y = numpy.asarray(y, dtype = numpy.float64)
+    if method == "min max":
+        numberOfBuckets = (maximumPoints - 2) // 2
+    else:  # method == "lttb"
+        numberOfBuckets = maximumPoints - 2
+    # bucket k holds the points bounds[k] up to (excluding) bounds[k+1]
+    bounds = [1 + (k * (n - 2)) // numberOfBuckets
+              for k in range(numberOfBuckets + 1)]
+    result = [0]
+    for k in range(numberOfBuckets):
+        first = bounds[k]
+        last = bounds[k+1]
+        if method == "min max":
+            if numpy is not None:
+                bucket = y[first:last]
+                pair = (first + int(numpy.argmin(bucket)),
+                        first + int(numpy.argmax(bucket)))
+            else:
+                pair = (min(range(first, last), key = y.__getitem__),
+                        max(range(first, last), key = y.__getitem__))
+            result.extend(sorted(set(pair)))
+        else:
+            # the third point: average of the next bucket (or the last point)
+            if k + 1 < numberOfBuckets:
+                nextFirst = last
+                nextLast = bounds[k+2]
+            else:
+                nextFirst = n - 1
+                nextLast = n
+            previous = result[-1]
+            if numpy is not None:
+                averageX = float(numpy.mean(x[nextFirst:nextLast]))
+                averageY = float(numpy.mean(y[nextFirst:nextLast]))
+                areas = numpy.abs(
+                  (x[previous] - averageX) * (y[first:last] - y[previous]) -
+                  (x[previous] - x[first:last]) * (averageY - y[previous]))
+                result.append(first + int(numpy.argmax(areas)))
+            else:
+                count = nextLast - nextFirst
+                averageX = sum(x[nextFirst:nextLast]) / count
+                averageY = sum(y[nextFirst:nextLast]) / count
+                result.append(max(range(first, last), key = lambda i: abs(
+                  (x[previous] - averageX) * (y[i] - y[previous]) -
+                  (x[previous] - x[i]) * (averageY - y[previous]))))
+    result.append(n - 1)
+    return result
@@ -1,8 +1,11 @@
 # module laps
 
-from copy import deepcopy
+from bisect import bisect_left
+from copy import copy
 
 from myPyGPX import *
+import kernels
+import profiling
 
 class Lap(Track):
     """ A lap during an activity; extracted from some track of that activity.
@@ -84,18 +87,7 @@ class Lap(Track):
           if the fastest pace is found at different locations, only the last
           location is returned.
         """
-        seriesList = Track.produceSeries(self, measureAlong +" series")
-        seriesList = Analyse.filterSeries(seriesList, nForAverage)
-
-        maxPace = None
-
-        for element in seriesList:
-                if (maxPace == None):
-                    maxPace = element
-                elif(element[1] < maxPace[1]):
-                    maxPace = element
-
-        return maxPace
+        return self.getPaceStatistics(nForAverage, measureAlong)["fastestPace"]
 
     # could be a method from super-class Track!
     def getSlowestPace(self, nForAverage, measureAlong = "distance"):
@@ -122,24 +114,449 @@ class Lap(Track):
           if the slowest pace is found at different locations, only the last
           location is returned.
         """
+        return self.getPaceStatistics(nForAverage, measureAlong)["slowestPace"]
 
-        seriesList = Track.produceSeries(self, measureAlong +" series")
+    # could be a method from super-class Track!
+    def getPaceStatistics(self, nForAverage, measureAlong = "distance",
+                          percentiles = ()):
+        """ Returns a summary of the instant pace along the lap.
+
+        The series of instant pace is produced and filtered as for
+        getFastestPace() and getSlowestPace(), once, and all the figures are
+        obtained from it in a single pass (see kernels.seriesStatistics()).
+        Requires:
+          nForAverage and measureAlong as for getFastestPace();
+          percentiles is a sequence of numbers between 0 and 100.
+        Ensures:
+          a dict with
+            "fastestPace": the pair returned by getFastestPace();
+            "slowestPace": the pair returned by getSlowestPace();
+            "meanPace" and "standardDeviation" of the filtered pace;
+            "percentiles": a dict mapping each of the given percentiles to
+              the corresponding pace.
+          Pace is in min/km; a smaller pace is a faster pace, so e.g. the
+          10th percentile is a fast pace.
+        """
+        seriesList = self.produceSeries(measureAlong +" series")
         seriesList = Analyse.filterSeries(seriesList, nForAverage)
+        statistics = kernels.seriesStatistics(
+          [element[1] for element in seriesList], percentiles)
+        return {"fastestPace": seriesList[statistics["minimumIndex"]],
+                "slowestPace": seriesList[statistics["maximumIndex"]],
+                "meanPace": statistics["mean"],
+                "standardDeviation": statistics["standardDeviation"],
+                "percentiles": dict(zip(percentiles,
+                                        statistics["percentiles"]))}
+
+    @staticmethod
+    def getPaceStatisticsOfLaps(listOfLaps, nForAverage,
+                                measureAlong = "distance", percentiles = ()):
+        """ Returns the pace summary of each lap of a list of laps.
+
+        Typically used on the result of a LapExtractor method.
+        Requires:
+          listOfLaps is a list of Lap;
+          the other parameters as for getPaceStatistics(), for every lap.
+        Ensures:
+          a list with the dict returned by getPaceStatistics() for each lap,
+          in the same order.
+        """
+        return [lap.getPaceStatistics(nForAverage, measureAlong, percentiles)
+                for lap in listOfLaps]
+
+
+class LapView(Lap):
+    """ A lap that refers to a range of the track points of its track.
+
+    Unlike Lap, a LapView neither copies nor modifies any track point: it
+    keeps a reference to the serialized reference track and the indices of
+    its first and last track points. The distance along the lap is obtained
+    as an offset from startingDistance, in the list of accumulated distances
+    that LapExtractor took when it was created (the track points may be
+    given other values afterwards, e.g. by a Lap sharing them), and the
+    speeds are computed within
+    the lap (the first point of the lap takes the speed of the second one),
+    as Lap would do. Creating a LapView takes constant time and memory.
+    The methods that Track implements by walking its track segments work on
+    a Lap of copies of the track points, made on first use (see
+    trackSegList); a LapView cannot be modified (addTrackSeg() raises
+    TypeError).
+    """
 
-        minPace = None
+    def __init__(self, lapNumber, serializedTrack, firstIndex, lastIndex,
+                 accumulatedDistances):
+        """ Creates a lap from a range of a list of track points.
 
-        for element in seriesList:
-                if (minPace == None):
-                    minPace = element
-                elif(element[1] > minPace[1]):
-                    minPace = element
+        Requires:
+          a positive int lapNumber;
+          serializedTrack is a list of sequential track points (as returned
+          by Track.getSerialized()); it must not be modified afterwards;
+          0 <= firstIndex < lastIndex < len(serializedTrack);
+          accumulatedDistances is the list of the accumulated distance of
+          each track point of serializedTrack; it must not be modified
+          afterwards.
+        """
+        # no Track.__init__(): the track segments are given by trackSegList
+        self._memo = {}
+        self._memoKey = None
+        self.lapNumber = lapNumber
+        self.serializedTrack = serializedTrack
+        self.firstIndex = firstIndex
+        self.lastIndex = lastIndex
+        self.accumulatedDistances = accumulatedDistances
+        self.startingDistance = accumulatedDistances[firstIndex]
+
+    @property
+    def trackSegList(self):
+        """ The track segments of the Lap of copies of self's track points.
+
+        Lets the methods inherited from Track see the same track points as
+        they would in a Lap (see _toLap()).
+        """
+        return self._toLap().trackSegList
+
+    def _getMemo(self):
+        """ Returns the memo of self (see Track._getMemo()).
 
-        return minPace
+        The track points of a LapView never change, so it is never emptied.
+        """
+        return self._memo
+
+    def addTrackSeg(self, trackSeg):
+        raise TypeError("a LapView cannot be modified")
+
+    def getIndexRange(self):
+        """ Returns the pair (first index, last index) of self's track points
+
+        The indices refer to the serialized reference track.
+        """
+        return (self.firstIndex, self.lastIndex)
+
+    def _getPoints(self):
+        """ Returns a new list with the (shared) track points of self """
+        return self.serializedTrack[self.firstIndex:self.lastIndex + 1]
+
+    def _computeAttributes(self):
+        """ Returns the lap-relative attributes of each track point.
+
+        The track points are not modified; the result is memoized.
+        Ensures: a dict with the lists "accumulatedDistance",
+          "accumulatedElevation" and "speed", one entry per track point.
+        """
+        memo = self._getMemo()
+        if "attributes" not in memo:
+            pointList = self._getPoints()
+            (stepDistance, accumulatedDistance) = \
+              kernels.consecutiveDistances(
+                [trackPoint.getLatitude() for trackPoint in pointList],
+                [trackPoint.getLongitude() for trackPoint in pointList])
+            speed = kernels.speeds(stepDistance,
+              [trackPoint.getEpochMicroseconds()
+               for trackPoint in pointList], timeUnit = 1000000)
+            accumulatedElevation = [0]
+            for i in range(1, len(pointList)):
+                verticalDistanceFromPrevious = pointList[i].getElevation() - \
+                  pointList[i-1].getElevation()
+                if verticalDistanceFromPrevious < 0:
+                    verticalDistanceFromPrevious = 0
+                accumulatedElevation.append(accumulatedElevation[-1] +
+                                            verticalDistanceFromPrevious)
+            memo["attributes"] = {
+              "accumulatedDistance":
+                [distance - self.startingDistance for distance in
+                 self.accumulatedDistances[self.firstIndex:
+                                           self.lastIndex + 1]],
+              "accumulatedElevation": accumulatedElevation,
+              "speed": speed.tolist()}
+        return memo["attributes"]
+
+    def _toLap(self):
+        """ Returns a Lap holding copies of self's track points.
+
+        The copies have their attributes set as computed within the lap.
+        The Lap is made once, and memoized.
+        """
+        memo = self._getMemo()
+        if "lap" not in memo:
+            attributes = self._computeAttributes()
+            listOfPoints = []
+            for i, trackPoint in enumerate(self._getPoints()):
+                trackPointCopy = copy(trackPoint)
+                trackPointCopy.setAccumulatedDistance(
+                  attributes["accumulatedDistance"][i])
+                trackPointCopy.setAccumulatedElevation(
+                  attributes["accumulatedElevation"][i])
+                trackPointCopy.setSpeed(attributes["speed"][i])
+                listOfPoints.append(trackPointCopy)
+            memo["lap"] = Lap(self.lapNumber, self.startingDistance,
+                              listOfPoints)
+        return memo["lap"]
+
+    def getStartTime(self):
+        return self.serializedTrack[self.firstIndex].getTime()
+
+    def getFinishTime(self):
+        return self.serializedTrack[self.lastIndex].getTime()
+
+    @profiling.timed("Track.produceSeries",
+                     lambda lapView, *arguments:
+                       lapView.lastIndex - lapView.firstIndex + 1)
+    def _produceSeries(self, arrangeAs, dataKind):
+        """ Computes the series returned by produceSeries().
+
+        Same contract as Track.produceSeries(), without touching the track
+        points; profiled under the same name.
+        """
+        # maximum allowed pace (a kind of constant):
+        MAXIMUM_PACE = 60.0
+        # this implies that the minimum allowed speed is...
+        MINIMUM_SPEED = 100 / (6 * MAXIMUM_PACE)
+        pointList = self._getPoints()
+        attributes = self._computeAttributes()
+        if arrangeAs == "time series":
+            initialTime = self.getStartTime().epochMicroseconds
+            # as Time.timeInterval()
+            x = [(trackPoint.getEpochMicroseconds() - initialTime) / 1000000
+                 for trackPoint in pointList]
+        else:  # arrangeAs == "distance series"
+            x = attributes["accumulatedDistance"]
+        if dataKind == "pace":
+            y = [(1/speed) * 100/6 if speed > MINIMUM_SPEED else MAXIMUM_PACE
+                 for speed in attributes["speed"]]
+        elif dataKind == "speed km/h":
+            y = [speed * 36/10 for speed in attributes["speed"]]
+        else:  # dataKind == "elevation"
+            y = [trackPoint.getElevation() for trackPoint in pointList]
+        return list(zip(x, y))
+
+    def produceXYdata(self):
+        return [(trackPoint.getLongitude(), trackPoint.getLatitude())
+                for trackPoint in self._getPoints()]
+
+    def getSerialized(self):
+        """ Returns copies of the track points of self in a simple list.
+
+        The copies have their accumulatedDistance attribute measured from
+        the beginning of the lap.
+        """
+        return self._toLap().getSerialized()
+
+    def hidePartOfTrack(self, center_lat, center_lon, radius):
+        return self._toLap().hidePartOfTrack(center_lat, center_lon, radius)
+
+    def hidePartsOfTrack(self, listOfZones):
+        return self._toLap().hidePartsOfTrack(listOfZones)
+
+    def totalDistance(self):
+        """ Returns the total distance of this lap. """
+        return self.accumulatedDistances[self.lastIndex] - \
+               self.startingDistance
+
+    def totalAccumulatedElevation(self):
+        """ Returns the total accumulated positive elevation of this lap. """
+        return self._computeAttributes()["accumulatedElevation"][-1]
+
+    def getRangeIndex(self):
+        """ Returns the RangeIndex of self, over the track points of the lap.
+
+        Index 0 is the first track point of the lap. The index is built
+        from the attributes computed within the lap (see
+        _computeAttributes()), as Track.getRangeIndex() does for a Lap, and
+        is memoized.
+        """
+        memo = self._getMemo()
+        if "rangeIndex" not in memo:
+            attributes = self._computeAttributes()
+            memo["rangeIndex"] = RangeIndex(
+              attributes["accumulatedDistance"],
+              attributes["accumulatedElevation"],
+              [trackPoint.getEpochMicroseconds()
+               for trackPoint in self._getPoints()],
+              attributes["speed"], timeUnit = 1000000)
+        return memo["rangeIndex"]
+
+
+class LapSummary:
+    """ Compact description of a lap: no track points, only its figures.
+
+    Produced in batches by LapExtractor.getLapSummaries(). Offers the same
+    figures as Lap, with the same methods.
+    """
+
+    def __init__(self, lapNumber, firstIndex, lastIndex, startingDistance,
+                 distance, time):
+        """ Creates the summary of a lap.
+
+        Requires:
+          a positive int lapNumber;
+          firstIndex and lastIndex are the indices of the first and last
+          track points of the lap in the serialized reference track;
+          startingDistance, distance (in meters) and time (in seconds) are
+          non-negative numbers.
+        """
+        self.lapNumber = lapNumber
+        self.firstIndex = firstIndex
+        self.lastIndex = lastIndex
+        self.startingDistance = startingDistance
+        self.distance = distance
+        self.time = time
+
+    def getLapNumber(self):
+        return self.lapNumber
+
+    def getIndexRange(self):
+        """ Returns the pair (first index, last index) of the lap's points """
+        return (self.firstIndex, self.lastIndex)
+
+    def getStartingDistance(self):
+        return self.startingDistance
+
+    def totalDistance(self):
+        return self.distance
+
+    def totalTime(self):
+        return self.time
+
+    def averageSpeed(self, expressAs = "pace"):
+        """ Returns the average speed of this lap.
+
+        Same contract as Track.averageSpeed().
+        """
+        averageSpeedMetersPerSecond = self.distance/self.time
+        if expressAs == "pace":
+            result = (1/averageSpeedMetersPerSecond) * 100/6
+        else:  # expressAs = "speed km/h"
+            result = averageSpeedMetersPerSecond * 36/10
+        return result
+
+    def __repr__(self):
+        return "LapSummary(" + str(self.lapNumber) + ", " \
+          + str(self.firstIndex) + ", " + str(self.lastIndex) + ", " \
+          + str(self.startingDistance) + ", " + str(self.distance) + ", " \
+          + str(self.time) + ")"
+
+
+class LapTracker:
+    """ Splits a track into laps online, as its track points arrive.
+
+    Unlike LapExtractor, which needs the whole track, a LapTracker is fed one
+    track point at a time (e.g. by a live recorder, or by
+    GPXparser.iterTrackPoints()) and reports each lap as soon as it is
+    completed. It keeps only running totals and the previous track point, so
+    its memory use does not grow with the track.
+    The laps are those of LapExtractor.getAutoLapsByDistance() or
+    getAutoLapsByTime() for the same track points (consecutive points are
+    paired across track segments, as in Track), reported as LapSummary;
+    distances are computed with Point.distance(), so they may differ in the
+    last digits from those of Track when NumPy is used (see module kernels).
+    Usage:
+      tracker = LapTracker("distance", 1000)
+      for lap in tracker.feed(GPXparser.iterTrackPoints(gpxFileName)):
+          ...  # each completed lap
+      lastLap = tracker.finish()
+    """
+
+    def __init__(self, splitBy = "distance", autoSplitValue = 998.03):
+        """ Creates a tracker for a new track, with no track points yet.
+
+        Requires:
+          splitBy = "distance" (autoSplitValue in meters) or "time"
+          (autoSplitValue in seconds);
+          autoSplitValue is a positive number.
+        """
+        self.splitBy = splitBy
+        self.autoSplitValue = autoSplitValue
+        # running totals over the whole track
+        self.numberOfPoints = 0
+        self.previousPoint = None
+        self.accumulatedDistance = 0
+        # the current lap
+        self.lapNumber = 1
+        self.lapFirstIndex = 0
+        self.lapStartingDistance = 0
+        self.lapStartingTime = None  # see Time.epochMicroseconds
+
+    def getAccumulatedDistance(self):
+        """ Returns the distance from the first point to the last one fed """
+        return self.accumulatedDistance
+
+    def getNumberOfPoints(self):
+        return self.numberOfPoints
+
+    def addPoint(self, trackPoint):
+        """ Adds the next track point, and returns the lap it completes.
+
+        Requires: trackPoint is a TrackPoint with a time; points are added in
+          track order.
+        Ensures: the LapSummary of the lap ended by trackPoint, if its distance
+          (or time) from the beginning of the lap reaches autoSplitValue;
+          otherwise None. trackPoint also begins the next lap.
+        """
+        time = trackPoint.getEpochMicroseconds()
+        index = self.numberOfPoints
+        self.numberOfPoints += 1
+        previousPoint = self.previousPoint
+        self.previousPoint = trackPoint
+        if previousPoint is None:
+            self.lapStartingTime = time
+            return None
+        self.accumulatedDistance += trackPoint.distance(previousPoint)
+        lapDistance = self.accumulatedDistance - self.lapStartingDistance
+        if self.splitBy == "distance":
+            reached = lapDistance >= self.autoSplitValue
+        else:  # self.splitBy == "time"
+            reached = (time - self.lapStartingTime) / 1000000 \
+                      >= self.autoSplitValue
+        if not reached:
+            return None
+        return self._completeLap(index, time)
+
+    def feed(self, points):
+        """ Adds track points, yielding each lap as soon as it is completed.
+
+        Requires: points is an iterable of TrackPoint, as for addPoint().
+        Ensures: a generator of LapSummary.
+        """
+        for trackPoint in points:
+            lap = self.addPoint(trackPoint)
+            if lap is not None:
+                yield lap
+
+    def finish(self):
+        """ Ends the track, and returns its last lap if it is incomplete.
+
+        Ensures: the LapSummary of the lap from its beginning to the last
+          point added, or None if that lap has less than 2 track points.
+        """
+        lastIndex = self.numberOfPoints - 1
+        if lastIndex <= self.lapFirstIndex:
+            return None
+        return self._completeLap(lastIndex,
+                                 self.previousPoint.getEpochMicroseconds())
+
+    def _completeLap(self, index, time):
+        """ Ends the current lap at the given point and begins the next one """
+        lap = LapSummary(self.lapNumber, self.lapFirstIndex, index,
+                         self.lapStartingDistance,
+                         self.accumulatedDistance - self.lapStartingDistance,
+                         (time - self.lapStartingTime) / 1000000)
+        self.lapNumber += 1
+        self.lapFirstIndex = index
+        self.lapStartingDistance = self.accumulatedDistance
+        self.lapStartingTime = time
+        return lap
+
+
+def _numberOfTrackPoints(lapExtractor, *arguments, **keywordArguments):
+    """ Returns the number of track points of the reference track of a
+    LapExtractor (see profiling) """
+    return len(lapExtractor.serializedTrack)
 
 
 class LapExtractor:
     """ Provides methods to extract and build laps from some track. """
     
+    @profiling.timed("LapExtractor.__init__", _numberOfTrackPoints)
     def __init__(self, referenceTrack):
         """ At creation time, connects self with its reference track.
 
@@ -148,11 +565,62 @@ class LapExtractor:
         """
         # obtain a simple list of TrackPoint from the reference track:
         self.serializedTrack = referenceTrack.getSerialized()
+        # cumulative values along the serialized track; the distances are
+        # taken now, as the track points may be given other values later
+        # (e.g. by a Lap sharing them), and are shared by all the laps
+        self._accumulatedDistances = \
+          [trackPoint.getAccumulatedDistance()
+           for trackPoint in self.serializedTrack]
+        self._epochMicroseconds = None
 
     def getSerializedTrack(self):
         return self.serializedTrack
 
+    def _getAccumulatedDistances(self):
+        """ Returns the list of the accumulatedDistance of each track point,
+        as taken when self was created """
+        return self._accumulatedDistances
+
+    def _getEpochMicroseconds(self):
+        """ Returns the list of the time of each track point, as an int.
+
+        See Time.epochMicroseconds.
+        """
+        if self._epochMicroseconds is None:
+            self._epochMicroseconds = \
+              [trackPoint.getEpochMicroseconds()
+               for trackPoint in self.serializedTrack]
+        return self._epochMicroseconds
+
+    @staticmethod
+    def _findBoundary(values, lo, reference, threshold, scale = 1):
+        """ Returns the first index where a cumulative value reaches a threshold.
+
+        Uses binary search: O(log n) for n values.
+        Requires:
+          values is a non-decreasing list of numbers;
+          0 <= lo <= len(values).
+        Ensures:
+          the smallest index j >= lo such that
+            (values[j] - reference) / scale >= threshold,
+          evaluated exactly as written (the linear scans compared the same
+          expression); len(values) if there is no such index.
+        """
+        def reached(j):
+            return (values[j] - reference) / scale >= threshold
+        # the bisection gives the answer up to floating point rounding in
+        # the target; the exact expression settles the neighbouring indices
+        j = bisect_left(values, reference + threshold * scale, lo)
+        while j > lo and reached(j - 1):
+            j -= 1
+        while j < len(values) and not reached(j):
+            j += 1
+        return j
+
     # auxiliary method
+    @profiling.timed("LapExtractor._split",
+                     lambda lapExtractor, listOfSplitIndices:
+                       listOfSplitIndices[-1] - listOfSplitIndices[0] + 1)
     def _split(self, listOfSplitIndices):
         """ Returns a list of laps from the reference track.
 
@@ -179,35 +647,140 @@ class LapExtractor:
           thus ensuring that no lap will have less than 2 track points;
           listOfSplitIndices[-1] = len(self.serializedTrack) - 1.
         Ensures:
-          a list of consecutive laps where each lap has at least 2 track points.
+          a list of consecutive laps where each lap has at least 2 track points;
+          the laps are instances of LapView, created in constant time each.
         """
         listOfLaps = []
         lapNumber = 0
         for i in range(len(listOfSplitIndices)-1):
             lapNumber += 1
-            # obtain the list of track points for the next lap to be created;
-            # the track points are cloned form a section of the (serialized)
-            # reference track
-            nextListOfPoints = \
-              deepcopy(self.serializedTrack[listOfSplitIndices[i]:
-                                            listOfSplitIndices[i+1] + 1])
-            # register the initialAccumulatedDistance of this lap, with respect
-            # to the beginning of the track
-            initialAccumulatedDistance = \
-                                nextListOfPoints[0].getAccumulatedDistance()
-            # reset the accumulated distance within the lap, taking as internal
-            # reference the first point of the lap
-            for point in nextListOfPoints:
-                point.setAccumulatedDistance( \
-                  point.getAccumulatedDistance() - initialAccumulatedDistance)
-            # now create the lap with its corresponding list of track points
-            nextLap = Lap(lapNumber,
-                          initialAccumulatedDistance,
-                          nextListOfPoints)
-            # apend the newly created lap to the list of laps
-            listOfLaps.append(nextLap)
+            # each lap refers to its section of the (serialized) reference
+            # track, which is neither copied nor modified
+            listOfLaps.append(LapView(lapNumber, self.serializedTrack,
+                                      listOfSplitIndices[i],
+                                      listOfSplitIndices[i+1],
+                                      self._accumulatedDistances))
+        profiling.count("LapExtractor laps created", len(listOfLaps))
         return listOfLaps
 
+    def _splitIndicesByDistance(self, autoSplitValue):
+        """ Returns the list of split indices for getAutoLapsByDistance() """
+        accumulatedDistances = self._getAccumulatedDistances()
+        lastIndex = len(accumulatedDistances) - 1
+        # build the list of split indices: each lap ends at the first point
+        # whose distance from the beginning of the lap reaches autoSplitValue
+        # (or at the last point of the track)
+        listOfSplitIndices = [0]
+        while listOfSplitIndices[-1] < lastIndex:
+            lapStart = listOfSplitIndices[-1]
+            lapEnd = self._findBoundary(accumulatedDistances, lapStart + 1,
+                                        accumulatedDistances[lapStart],
+                                        autoSplitValue)
+            listOfSplitIndices.append(min(lapEnd, lastIndex))
+        return listOfSplitIndices
+
+    def _splitIndicesByTime(self, autoSplitValue):
+        """ Returns the list of split indices for getAutoLapsByTime() """
+        epochMicroseconds = self._getEpochMicroseconds()
+        lastIndex = len(epochMicroseconds) - 1
+        # build the list of split indices: each lap ends at the first point
+        # whose elapsed time since the beginning of the lap reaches
+        # autoSplitValue (or at the last point of the track)
+        listOfSplitIndices = [0]
+        while listOfSplitIndices[-1] < lastIndex:
+            lapStart = listOfSplitIndices[-1]
+            lapEnd = self._findBoundary(epochMicroseconds, lapStart + 1,
+                                        epochMicroseconds[lapStart],
+                                        autoSplitValue, scale = 1000000)
+            listOfSplitIndices.append(min(lapEnd, lastIndex))
+        return listOfSplitIndices
+
+    def _splitIndicesFromDistanceMarkers(self, listOfMarkers):
+        """ Returns the list of split indices for
+        getLapsFromListOfDistanceMarkers()
+        """
+        accumulatedDistances = self._getAccumulatedDistances()
+        lastIndex = len(accumulatedDistances) - 1
+        # build the list of split indices: each lap ends at the first point
+        # (from the beginning of the lap on) whose accumulated distance
+        # reaches the next marker (or at the last point of the track)
+        listOfSplitIndices = [0]
+        markerIndex = 0  # markerIndex refers to the list listOfMarkers
+        while listOfSplitIndices[-1] < lastIndex:
+            lapEnd = self._findBoundary(accumulatedDistances,
+                                        listOfSplitIndices[-1], 0,
+                                        listOfMarkers[markerIndex])
+            listOfSplitIndices.append(min(lapEnd, lastIndex))
+            markerIndex += 1
+        return listOfSplitIndices
+
+    def _splitIndicesFromTimeMarkers(self, listOfMarkers):
+        """ Returns the list of split indices for getLapsFromListOfTimeMarkers()
+        """
+        epochMicroseconds = self._getEpochMicroseconds()
+        lastIndex = len(epochMicroseconds) - 1
+        # build the list of split indices: each lap ends at the first point
+        # (from the beginning of the lap on) whose elapsed time since the
+        # start of the track reaches the next marker (or at the last point)
+        listOfSplitIndices = [0]
+        markerIndex = 0  # markerIndex refers to the list listOfMarkers
+        while listOfSplitIndices[-1] < lastIndex:
+            lapEnd = self._findBoundary(epochMicroseconds,
+                                        listOfSplitIndices[-1],
+                                        epochMicroseconds[0],
+                                        listOfMarkers[markerIndex],
+                                        scale = 1000000)
+            listOfSplitIndices.append(min(lapEnd, lastIndex))
+            markerIndex += 1
+        return listOfSplitIndices
+
+    @profiling.timed("LapExtractor.getLapSummaries", _numberOfTrackPoints)
+    def getLapSummaries(self, listOfSplitSpecs):
+        """ Obtains several lap schemes at once, as compact lap summaries.
+
+        Each split spec is a pair (splitBy, value), where splitBy is one of
+          "distance": auto-laps at distance intervals of value meters
+            (as getAutoLapsByDistance(value));
+          "time": auto-laps at time intervals of value seconds
+            (as getAutoLapsByTime(value));
+          "distance markers": value is a list of distance markers
+            (as getLapsFromListOfDistanceMarkers(value));
+          "time markers": value is a list of time markers
+            (as getLapsFromListOfTimeMarkers(value)).
+        All the schemes share the cumulative lists of self, and no lap or
+        track point is created.
+        Requires:
+          listOfSplitSpecs is a list of pairs as described, each value
+          satisfying the requirements of the corresponding method.
+        Ensures:
+          a list with, for each split spec and in the same order, the list
+          of LapSummary of the corresponding laps; their figures are equal to
+          those of the laps returned by the corresponding method.
+        """
+        splitMethods = {
+          "distance": self._splitIndicesByDistance,
+          "time": self._splitIndicesByTime,
+          "distance markers": self._splitIndicesFromDistanceMarkers,
+          "time markers": self._splitIndicesFromTimeMarkers}
+        accumulatedDistances = self._getAccumulatedDistances()
+        epochMicroseconds = self._getEpochMicroseconds()
+        result = []
+        for (splitBy, value) in listOfSplitSpecs:
+            listOfSplitIndices = splitMethods[splitBy](value)
+            listOfSummaries = []
+            for i in range(len(listOfSplitIndices)-1):
+                first = listOfSplitIndices[i]
+                last = listOfSplitIndices[i+1]
+                listOfSummaries.append(LapSummary(i + 1, first, last,
+                  accumulatedDistances[first],
+                  accumulatedDistances[last] - accumulatedDistances[first],
+                  (epochMicroseconds[last] - epochMicroseconds[first])
+                    / 1000000))
+            result.append(listOfSummaries)
+        return result
+
+    @profiling.timed("LapExtractor.getAutoLapsByDistance",
+                     _numberOfTrackPoints)
     def getAutoLapsByDistance(self, autoSplitValue = 998.03):
         """ Obtains the list of laps from the serialized track. 
 
@@ -217,31 +790,12 @@ class LapExtractor:
         Ensures: a list of consecutive laps where the last point of a lap is
           also the first point of the next lap.
         """
-        # build the list of split indices
-        listOfSplitIndices = [0]
-        index = 1
-        while index < len(self.serializedTrack):
-            # define a distance as measured along the lap, starting from 0
-            # at the first point of the lap
-            lapDistance = 0
-            initialAccumulatedDistance = \
-                        self.serializedTrack[index - 1].getAccumulatedDistance()
-            while lapDistance < autoSplitValue and \
-                  index < len(self.serializedTrack):            
-                lapDistance = \
-                  self.serializedTrack[index].getAccumulatedDistance() - \
-                  initialAccumulatedDistance
-                index += 1
-            # if either lapDistance >= autoSplitValue
-            #        or index = len(self.serializedTrack)
-            # then the end of a lap has been reached;
-            # the end of the lap is registered at index - 1 to compensate
-            # for the increment index += 1 at the end of the loop body
-            listOfSplitIndices.append(index - 1)
+        listOfSplitIndices = self._splitIndicesByDistance(autoSplitValue)
         # pass the list of split indices to the auxiliary method _split()
         # to obtain a list of laps from the reference track
         return self._split(listOfSplitIndices)
 
+    @profiling.timed("LapExtractor.getAutoLapsByTime", _numberOfTrackPoints)
     def getAutoLapsByTime(self, autoSplitValue = 240.0):
         """ Obtains the list of laps from the serialized track. 
 
@@ -251,29 +805,13 @@ class LapExtractor:
         Ensures: a list of consecutive laps where the last point of a lap is
           also the first point of the next lap.
         """
-        # build the list of split indices
-        listOfSplitIndices = [0]
-        index = 1
-        while index < len(self.serializedTrack):
-            # define elapsed time as measured along the lap, starting from 0
-            # at the first point of the lap
-            lapTime = 0
-            initialTime = self.serializedTrack[index - 1].getTime()
-            while lapTime < autoSplitValue and \
-                  index < len(self.serializedTrack):            
-                lapTime = \
-                 self.serializedTrack[index].getTime().timeInterval(initialTime)
-                index += 1
-            # if either lapTime >= autoSplitValue
-            #        or index = len(self.serializedTrack)
-            # then the end of a lap has been reached;
-            # the end of the lap is registered at index - 1 to compensate
-            # for the increment index += 1 at the end of the loop body
-            listOfSplitIndices.append(index - 1)
+        listOfSplitIndices = self._splitIndicesByTime(autoSplitValue)
         # pass the list of split indices to the auxiliary method _split()
         # to obtain a list of laps from the reference track
         return self._split(listOfSplitIndices)
 
+    @profiling.timed("LapExtractor.getLapsFromListOfDistanceMarkers",
+                     _numberOfTrackPoints)
     def getLapsFromListOfDistanceMarkers(self, listOfMarkers):
         """ Obtains the list of laps from the serialized track. 
 
@@ -289,28 +827,14 @@ class LapExtractor:
           a list of consecutive laps where the last point of a lap is also
           the first point of the next lap.
         """
-        # build the list of split indices
-        listOfSplitIndices = [0]
-        index = 1        # index refers to the list self.serializedTrack
-        markerIndex = 0  # markerIndex refers to the list listOfMarkers
-        while index < len(self.serializedTrack):
-            # read the next split point from the list of markers
-            nextSplitPoint = listOfMarkers[markerIndex]
-            # use total accumulated distance from the begining of the reference
-            # track, not from the begining of the lap
-            totalAccDistance = \
-              self.serializedTrack[index - 1].getAccumulatedDistance()
-            while totalAccDistance < nextSplitPoint and \
-                  index < len(self.serializedTrack):            
-                totalAccDistance = \
-                  self.serializedTrack[index].getAccumulatedDistance()
-                index += 1
-            listOfSplitIndices.append(index - 1)
-            markerIndex += 1
+        listOfSplitIndices = \
+          self._splitIndicesFromDistanceMarkers(listOfMarkers)
         # pass the list of split indices to the auxiliary method _split()
         # to obtain a list of laps from the reference track
         return self._split(listOfSplitIndices)
     
+    @profiling.timed("LapExtractor.getLapsFromListOfTimeMarkers",
+                     _numberOfTrackPoints)
     def getLapsFromListOfTimeMarkers(self, listOfMarkers):
         """ Obtains the list of laps from the serialized track. 
 
@@ -326,23 +850,7 @@ class LapExtractor:
           a list of consecutive laps where the last point of a lap is also
           the first point of the next lap.
         """
-
-        # build the list of split indices
-        listOfSplitIndices = [0]
-        index = 1        # index refers to the list self.serializedTrack
-        markerIndex = 0  # markerIndex refers to the list listOfMarkers
-        startTime = self.serializedTrack[0].getTime()
-        while index < len(self.serializedTrack):
-            # read the next split point from the list of markers
-            nextSplitPoint = listOfMarkers[markerIndex]
-            # use total accumulated distance from the begining of the reference
-            # track, not from the begining of the lap
-            totalAccTime = self.serializedTrack[index - 1].getTime().timeInterval(startTime)
-            while totalAccTime < nextSplitPoint and index < len(self.serializedTrack):            
-                totalAccTime = self.serializedTrack[index].getTime().timeInterval(startTime)
-                index += 1
-            listOfSplitIndices.append(index - 1)
-            markerIndex += 1
+        listOfSplitIndices = self._splitIndicesFromTimeMarkers(listOfMarkers)
         # pass the list of split indices to the auxiliary method _split()
         # to obtain a list of laps from the reference track
         return self._split(listOfSplitIndices)
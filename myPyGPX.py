@@ -2,31 +2,54 @@
 
 """ Provides tools to process tracks and routes obtained from GPX files. """
 
+from bisect import bisect_left, bisect_right, insort
+from copy import copy
+from functools import total_ordering
 from math import pi, cos, sin, sqrt  # to compute distances between points
-# note: math import becomes redundant since all names are available also as
-# pylab.pi, pylab.cos, pylab.sin, pylab.sqrt
-import pylab
+from math import isfinite
+# note: pylab (i.e., matplotlib) is only imported when something is plotted;
+# see Plot. Everything else needs only the standard library (and, optionally,
+# NumPy; see module kernels).
 
 import GPXparser
+import kernels
+import profiling
 
 
 class GPXDocument:
     """ Representation of a GPX document. """
 
-    def __init__(self, gpxFileName):
+    def __init__(self, gpxFileName, cacheDirectory = None,
+                 parseProfile = "full"):
         """ Initializes a GPXDocument object by reading data from a file.
 
+        If cacheDirectory is given, the data is read from a cache file kept
+        in that directory, and the GPX file is only parsed when this cache
+        file is missing or out of date (see module trackcache); if the cache
+        file cannot be written, the data of the GPX file is used as parsed.
+        Only the fields of parseProfile are decoded from the GPX file (see
+        GPXparser.PARSE_PROFILES): e.g. with "laps", the points have no
+        elevation (0), name or description. The cache always holds every
+        field, and leaves out those not in parseProfile when it is read, so
+        the result is the same with or without the cache.
         Requires:
           gpxFileName is a string that names a reachable GPX file;
           this file contains at most 1 track;
-          this file contains at most 1 route.
+          this file contains at most 1 route;
+          cacheDirectory is None or a string that names a directory;
+          parseProfile is as for GPXparser.iterGPXElements().
         """
         self.fileName = gpxFileName        
         self.currentTrack = None
         self.currentRoute = None	
         self.currentWayPoints = []        
         # read the GPX file and populate the object's attributes
-        GPXparser.buildGPXDocument(gpxFileName, self)
+        if cacheDirectory is None:
+            GPXparser.buildGPXDocument(gpxFileName, self, parseProfile)
+        else:
+            import trackcache  # avoids circular imports
+            trackcache.buildGPXDocument(gpxFileName, self, cacheDirectory,
+                                        parseProfile = parseProfile)
 
     def getFileName(self):
         """ Returns the name of the file associated with this GPXDocument """
@@ -57,8 +80,52 @@ class GPXDocument:
         self.currentWayPoints = waypoints
 
 
+def _daysFromCivil(year, month, day):
+    """ Returns the number of days from 1970-01-01 to the given date.
+
+    Proleptic Gregorian calendar, as in datetime; negative before 1970.
+    URL source: http://howardhinnant.github.io/date_algorithms.html
+    """
+    if month <= 2:
+        year -= 1
+    era = year // 400
+    yearOfEra = year - era * 400                          # [0, 399]
+    dayOfYear = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    dayOfEra = yearOfEra * 365 + yearOfEra // 4 - yearOfEra // 100 \
+                 + dayOfYear                               # [0, 146096]
+    return era * 146097 + dayOfEra - 719468
+
+
+def _civilFromDays(days):
+    """ Returns (year, month, day) of the date days after 1970-01-01.
+
+    The inverse of _daysFromCivil() (same source).
+    """
+    days += 719468
+    era = days // 146097
+    dayOfEra = days - era * 146097                           # [0, 146096]
+    yearOfEra = (dayOfEra - dayOfEra // 1460 + dayOfEra // 36524
+                 - dayOfEra // 146096) // 365                 # [0, 399]
+    dayOfYear = dayOfEra - (365 * yearOfEra + yearOfEra // 4
+                            - yearOfEra // 100)               # [0, 365]
+    monthIndex = (5 * dayOfYear + 2) // 153                   # [0, 11]
+    day = dayOfYear - (153 * monthIndex + 2) // 5 + 1         # [1, 31]
+    month = monthIndex + 3 if monthIndex < 10 else monthIndex - 9
+    year = yearOfEra + era * 400 + (1 if month <= 2 else 0)
+    return (year, month, day)
+
+
+@total_ordering
 class Time:
-    """ Representation of a moment in time """
+    """ Representation of a moment in time
+
+    Times are compared, ordered and hashed by the moment they represent.
+    Instances have no __dict__ (see __slots__), since there is one per track
+    point.
+    """
+
+    __slots__ = ("year", "month", "day", "hour", "minute", "second",
+                 "epochMicroseconds")
 
     def __init__(self, year, month, day, hour, minute, second):
         """ Initializes the parameters according to most comon usage in GPX.
@@ -81,6 +148,37 @@ class Time:
         self.hour = hour
         self.minute = minute
         self.second = second
+        # absolute time, computed once: an int number of microseconds since
+        # 1970-01-01 00:00:00, so that differences are exact (the fraction of
+        # second is truncated to the microsecond, as datetime would do)
+        wholeSecond = int(second)
+        self.epochMicroseconds = \
+          ((((_daysFromCivil(year, month, day) * 24 + hour) * 60 + minute)
+            * 60 + wholeSecond) * 1000000) \
+          + int((second - wholeSecond) * 1000000)
+
+    @classmethod
+    def fromEpochMicroseconds(cls, epochMicroseconds):
+        """ Creates a Time from microseconds elapsed since 1970-01-01 00:00:00
+
+        The inverse of the epochMicroseconds attribute: the new Time keeps
+        the given value exactly, so time intervals are not affected by the
+        rounding of the float second.
+        Requires: epochMicroseconds is an int.
+        """
+        (seconds, microsecond) = divmod(epochMicroseconds, 1000000)
+        (days, seconds) = divmod(seconds, 86400)
+        time = cls.__new__(cls)
+        (time.year, time.month, time.day) = _civilFromDays(days)
+        time.hour = seconds // 3600
+        time.minute = seconds // 60 % 60
+        time.second = seconds % 60 + microsecond / 1000000
+        time.epochMicroseconds = epochMicroseconds
+        return time
+
+    def getEpochSeconds(self):
+        """ Returns self as seconds elapsed since 1970-01-01 00:00:00 (float)"""
+        return self.epochMicroseconds / 1000000
 
     def timeInterval(self, other):
         """ Computes the difference between self and another Time.
@@ -89,20 +187,20 @@ class Time:
         Requires: self and other are instances of Time.
         Ensures: a float which is the time elapsed between other and self.
         """
-        # import datetime
-        # https://docs.python.org/3/library/datetime.html
-        from datetime import datetime, timedelta
-        # initialize datetime.datetime objects with
-        # year, month, day, hour, minute, second, microsecond
-        selfDatetime = datetime(self.year, self.month, self.day,
-          self.hour, self.minute, int(self.second),
-          int((self.second - int(self.second)) * 1000000))
-        otherDatetime = datetime(other.year, other.month, other.day,
-          other.hour, other.minute, int(other.second),
-          int((other.second - int(other.second)) * 1000000))
-        # compute the difference as a datetime.timedelta object
-        timeDifference = selfDatetime - otherDatetime
-        return timeDifference.total_seconds()
+        return (self.epochMicroseconds - other.epochMicroseconds) / 1000000
+
+    def __eq__(self, other):
+        if not isinstance(other, Time):
+            return NotImplemented
+        return self.epochMicroseconds == other.epochMicroseconds
+
+    def __lt__(self, other):
+        if not isinstance(other, Time):
+            return NotImplemented
+        return self.epochMicroseconds < other.epochMicroseconds
+
+    def __hash__(self):
+        return hash(self.epochMicroseconds)
         
     def __str__(self):
         if self.second - int(self.second) < 0.0000005:
@@ -125,8 +223,12 @@ class Point:
       waypoints (class Waypoint) trough inheritance from class RoutePoint.
     At this basic level, only a coordinate pair (latitude, longitude) and
     an elevation need to be assigned.
+    Points have no __dict__: each class lists the attributes it adds in
+    __slots__, which makes points much smaller in memory.
     """
-    
+
+    __slots__ = ("lat", "lon", "elevation")
+
     def __init__(self, lat, lon, elevation):
         """ Initializes coordinate pair (latitude, longitude) and elevation.
 
@@ -176,6 +278,9 @@ class Point:
 class TrackPoint(Point):
     """ Representation of a GPX track point. """    
 
+    __slots__ = ("epochMicroseconds", "accumulatedDistance",
+                 "accumulatedElevation", "speed")
+
     def __init__(self, lat, lon, time, elevation):
         """ Initializes a TrackPoint with a rich set of features.
 
@@ -211,14 +316,52 @@ class TrackPoint(Point):
         #
         # read from GPX file; elevation may be absent
         super().__init__(lat, lon, elevation)
-        self.time = time                 # Time
+        # the Time is not kept, only the moment it represents (see getTime())
+        self.setTime(time)
         # computed later with dedicated methods
         self.accumulatedDistance = None  # float
         self.accumulatedElevation = None # float
         self.speed = None                # float
 
+    @classmethod
+    def fromEpochMicroseconds(cls, lat, lon, epochMicroseconds, elevation):
+        """ Creates a TrackPoint from its time given as an int, without
+        making a Time object.
+
+        Requires: epochMicroseconds is as Time.epochMicroseconds, or None if
+          the point has no time; the other parameters as for __init__().
+        """
+        trackPoint = cls(lat, lon, None, elevation)
+        trackPoint.epochMicroseconds = epochMicroseconds
+        return trackPoint
+
     def getTime(self):
-        return self.time
+        """ Returns the time of self, as a new Time object (None if absent).
+
+        Only the moment is kept in self (see getEpochMicroseconds()), so
+        each call returns a new Time, equal to the previous ones but not the
+        same object; changing it does not change self (use setTime()).
+        Prefer getEpochMicroseconds() where an int is enough.
+        """
+        if self.epochMicroseconds is None:
+            return None
+        return Time.fromEpochMicroseconds(self.epochMicroseconds)
+
+    def setTime(self, time):
+        """ Requires: time is an instance of Time, or None. """
+        if time is None:
+            self.epochMicroseconds = None
+        else:
+            self.epochMicroseconds = time.epochMicroseconds
+
+    # the time of self, as the attribute it used to be (reading it makes a
+    # new Time, and assigning it calls setTime())
+    time = property(getTime, setTime)
+
+    def getEpochMicroseconds(self):
+        """ Returns the time of self as Time.epochMicroseconds (None if
+        absent) """
+        return self.epochMicroseconds
 
     def setAccumulatedDistance(self, accDist):
         self.accumulatedDistance = accDist
@@ -242,6 +385,8 @@ class TrackPoint(Point):
 class RoutePoint(Point):
     """ Representation of a GPX route point. """    
 
+    __slots__ = ("name", "description")
+
     def __init__(self, lat, lon, elevation = None,
                  name = None, description = None):
         """ Initilizes a RoutePoint with a specific set of features.
@@ -262,6 +407,8 @@ class RoutePoint(Point):
 class WayPoint(RoutePoint):
     """ Representation of a GPX waypoint. """
 
+    __slots__ = ()
+
     # Inherits __init__ from RoutePoint.
     # A WayPoint is initialized as a (special) RoutePoint
     # Examples:
@@ -279,6 +426,8 @@ class ListPoints:
 
     def __init__(self):
         self.pointList = []  # will hold Point as TrackPoint or RoutePoint
+        # incremented on each change to pointList (see Track._getMemo())
+        self.modificationCount = 0
 
     def addPoint(self, point):
         """ Adds a point to self's list of points.
@@ -286,6 +435,7 @@ class ListPoints:
         Requires: point is an instance of Point.
         """
         self.pointList.append(point)
+        self.modificationCount += 1
 
     def getPointList(self):
         return self.pointList
@@ -299,16 +449,44 @@ class Route(ListPoints):
     """ Representation of a GPX route. """
     
 
+def _numberOfTrackPoints(track, *arguments, **keywordArguments):
+    """ Returns the number of track points of a Track (see profiling) """
+    return sum(len(trackSegment.getPointList())
+               for trackSegment in track.trackSegList)
+
+
 class Track:
     """ Representation of a GPX track. """
 
     def __init__(self):
         self.trackSegList = []  # list will contain TrackSeg
+        # memo of derived metrics, valid for the geometry given by _memoKey
+        self._memo = {}
+        self._memoKey = None
 
     def addTrackSeg(self, trackSeg):
         """ Requires: trackSeg is an instance of TrackSeg. """
         self.trackSegList.append(trackSeg)
 
+    def _getMemo(self):
+        """ Returns the memo of derived metrics of self.
+
+        The memo is a dict holding results that only depend on the track
+        points of self (e.g. which attributes of the track points have been
+        computed, and the series already produced).
+        It is emptied whenever the geometry of self changed since it was last
+        used, i.e. when a track segment was added with addTrackSeg() or a
+        point was added to a track segment with addPoint().
+        """
+        key = [len(self.trackSegList)]
+        for trackSegment in self.trackSegList:
+            key.append(id(trackSegment))
+            key.append(trackSegment.modificationCount)
+        if key != self._memoKey:
+            self._memo = {}
+            self._memoKey = key
+        return self._memo
+
     def getStartTime(self):
         """ Returns the starting time of self, in the form of a Time object. """
         return self.trackSegList[0].getPointList()[0].getTime()
@@ -340,48 +518,40 @@ class Track:
         Robustness measure: to avoid instability in case the data contains one
           or more points with speed = 0.0, or very close to 0.0, the pace is
           artificially limited to a maximum given by the constant MAXIMUM_PACE.
+        The series is memoized (see _getMemo()); each call returns a new list.
         """
+        memo = self._getMemo()
+        if ("series", arrangeAs, dataKind) not in memo:
+            memo["series", arrangeAs, dataKind] = \
+              self._produceSeries(arrangeAs, dataKind)
+        return list(memo["series", arrangeAs, dataKind])
+
+    @profiling.timed("Track.produceSeries", _numberOfTrackPoints)
+    def _produceSeries(self, arrangeAs, dataKind):
+        """ Computes the series returned by produceSeries(). """
         # maximum allowed pace (a kind of constant):
         MAXIMUM_PACE = 60.0
         # this implies that the minimum allowed speed is...
         MINIMUM_SPEED = 100 / (6 * MAXIMUM_PACE)
-        # ensure that the data has been computed, before being accessed
-        if arrangeAs == "distance series":
-            self._computeAccDistanceForEachTrackPoint()
-        if dataKind in ["pace", "speed km/h"]:
-            self._computeSpeedForEachTrackPoint()
-        # decide which getter to use for the X component
+        pointList = self._getAllTrackPoints()
+        # the derived attributes are read from the memo, not from the track
+        # points (see _ensureComputed())
         if arrangeAs == "time series":
-            initialTime = self.getStartTime()
-            def _getX(trackPoint):
-                return trackPoint.getTime().timeInterval(initialTime)
+            initialTime = self.getStartTime().epochMicroseconds
+            # as Time.timeInterval()
+            x = [(trackPoint.getEpochMicroseconds() - initialTime) / 1000000
+                 for trackPoint in pointList]
         else:  # arrangeAs == "distance series"
-            def _getX(trackPoint):
-                return trackPoint.getAccumulatedDistance()
-        # decide which getter to use for the Y component
+            x = self._getDerivedAttribute("accumulatedDistance")
         if dataKind == "pace":
-            def _getY(trackPoint):
-                speed = trackPoint.getSpeed()
-                # test to ensure that the speed is not too close to zero
-                if speed > MINIMUM_SPEED:
-                    pace = (1/speed) * 100/6
-                else:
-                    pace = MAXIMUM_PACE
-                return pace
+            # test to ensure that the speed is not too close to zero
+            y = [(1/speed) * 100/6 if speed > MINIMUM_SPEED else MAXIMUM_PACE
+                 for speed in self._getDerivedAttribute("speed")]
         elif dataKind == "speed km/h":
-            def _getY(trackPoint):
-                speed = trackPoint.getSpeed()
-                speedKm_H = speed * 36/10
-                return speedKm_H
+            y = [speed * 36/10 for speed in self._getDerivedAttribute("speed")]
         else:  # dataKind == "elevation"
-            def _getY(trackPoint):
-                return trackPoint.getElevation()
-        # now iterate over the track points in the track            
-        result = []
-        for trackSegment in self.trackSegList:
-            for trackPoint in trackSegment.getPointList():
-                result.append((_getX(trackPoint), _getY(trackPoint)))
-        return result 
+            y = [trackPoint.getElevation() for trackPoint in pointList]
+        return list(zip(x, y))
 
     def produceXYdata(self):
         """ Produces a list of XY coordinates from self, for further processing.
@@ -403,6 +573,99 @@ class Track:
                                trackPoint.getLatitude()))
         return result
 
+    def _getAllTrackPoints(self):
+        """ Returns a list with the track points of all the segments of self """
+        result = []
+        for trackSegment in self.trackSegList:
+            result.extend(trackSegment.getPointList())
+        return result
+
+    def _ensureComputed(self, attribute):
+        """ Computes an attribute of each track point, unless already done.
+
+        The values are kept in the memo, as a list with one value per track
+        point, in track order; they are set on the track points as well, but
+        the track points may be shared with other tracks (e.g. a Lap made
+        from getSerialized()), which set their own values on them. So the
+        methods of self read the memo, and getSerialized() sets the values
+        of self on the track points again.
+        Requires: attribute = "accumulatedDistance", "accumulatedElevation"
+          or "speed".
+        Ensures (as a side-effect): the attribute is computed for all the
+          track points of self, at most once for the current geometry.
+        """
+        memo = self._getMemo()
+        if attribute not in memo and not memo.get("derivedAttributesTried"):
+            # the first time, compute all three attributes in one pass
+            memo["derivedAttributesTried"] = True
+            self._computeDerivedAttributesForEachTrackPoint()
+        if attribute not in memo:
+            if attribute == "accumulatedDistance":
+                self._computeAccDistanceForEachTrackPoint()
+            elif attribute == "accumulatedElevation":
+                self._computeAccElevationForEachTrackPoint()
+            else:  # attribute == "speed"
+                self._computeSpeedForEachTrackPoint()
+
+    def _getDerivedAttribute(self, attribute):
+        """ Returns the list of the values of an attribute of each track point.
+
+        Requires: attribute as for _ensureComputed().
+        Ensures: the list kept in the memo (see _ensureComputed()), which
+          must not be modified.
+        """
+        self._ensureComputed(attribute)
+        return self._getMemo()[attribute]
+
+    @profiling.timed("Track._computeDerivedAttributesForEachTrackPoint",
+                     _numberOfTrackPoints)
+    def _computeDerivedAttributesForEachTrackPoint(self):
+        """ Computes the accumulatedDistance, accumulatedElevation and speed
+        attributes of each track point, in a single pass.
+
+        Same results as _computeAccDistanceForEachTrackPoint(),
+        _computeAccElevationForEachTrackPoint() and
+        _computeSpeedForEachTrackPoint(), but the distance between each pair
+        of consecutive track points is computed once for all three (see
+        kernels.derivedMetrics()).
+        The speed is only computed if there are at least 2 track points, and
+        every track point has a time.
+        Ensures (as a side-effect):
+            the attributes are computed for all the track points of self. 
+        """
+        pointList = self._getAllTrackPoints()
+        memo = self._getMemo()
+        if not pointList:  # nothing to compute
+            memo["accumulatedDistance"] = []
+            memo["accumulatedElevation"] = []
+            return
+        times = [trackPoint.getEpochMicroseconds() for trackPoint in pointList]
+        if None in times or len(pointList) < 2:
+            times = None
+        (accumulatedDistance, accumulatedElevation, speed) = \
+          kernels.derivedMetrics(
+            [trackPoint.getLatitude() for trackPoint in pointList],
+            [trackPoint.getLongitude() for trackPoint in pointList],
+            [trackPoint.getElevation() for trackPoint in pointList],
+            times, timeUnit = 1000000)
+        accumulatedDistance = accumulatedDistance.tolist()
+        accumulatedDistance[0] = 0
+        accumulatedElevation = accumulatedElevation.tolist()
+        accumulatedElevation[0] = 0
+        for trackPoint, distance, elevation in \
+          zip(pointList, accumulatedDistance, accumulatedElevation):
+            trackPoint.setAccumulatedDistance(distance)
+            trackPoint.setAccumulatedElevation(elevation)
+        memo["accumulatedDistance"] = accumulatedDistance
+        memo["accumulatedElevation"] = accumulatedElevation
+        if speed is not None:
+            speed = speed.tolist()
+            for trackPoint, pointSpeed in zip(pointList, speed):
+                trackPoint.setSpeed(pointSpeed)
+            memo["speed"] = speed
+
+    @profiling.timed("Track._computeAccDistanceForEachTrackPoint",
+                     _numberOfTrackPoints)
     def _computeAccDistanceForEachTrackPoint(self):
         """ Computes the accumulatedDistance attribute of each track point.
 
@@ -410,30 +673,25 @@ class Track:
         This is the distance measured along the track, from the first
         track point until each track point.
         Its value is zero for the first track point.
+        The distances are computed for the whole track at once, with
+        kernels.consecutiveDistances(); the first point of each segment is
+        measured from the last point of the previous segment.
         Ensures (as a side-effect):
             the attribute is computed for all the track points of self. 
         """
-        firstSegment = True
-        for trackSegment in self.trackSegList:
-            pointList = trackSegment.getPointList()
-            if firstSegment:
-                pointList[0].setAccumulatedDistance(0)
-                firstSegment = False
-            else: # firstSegment == False
-                distanceFromPrevious = \
-                    pointList[0].distance(lastPointPrevTrkSeg)
-                newAccumulatedDistance = \
-                    lastPointPrevTrkSeg.getAccumulatedDistance() + \
-                    distanceFromPrevious
-                pointList[0].setAccumulatedDistance(newAccumulatedDistance)
-            for i in range(1, len(pointList)):
-                distanceFromPrevious = pointList[i].distance(pointList[i-1])
-                newAccumulatedDistance = \
-                    pointList[i-1].getAccumulatedDistance() + \
-                    distanceFromPrevious
-                pointList[i].setAccumulatedDistance(newAccumulatedDistance)
-            lastPointPrevTrkSeg = pointList[-1]
-
+        pointList = self._getAllTrackPoints()
+        (stepDistance, accumulatedDistance) = kernels.consecutiveDistances(
+            [trackPoint.getLatitude() for trackPoint in pointList],
+            [trackPoint.getLongitude() for trackPoint in pointList])
+        accumulatedDistance = accumulatedDistance.tolist()
+        if accumulatedDistance:
+            accumulatedDistance[0] = 0
+        for trackPoint, distance in zip(pointList, accumulatedDistance):
+            trackPoint.setAccumulatedDistance(distance)
+        self._getMemo()["accumulatedDistance"] = accumulatedDistance
+
+    @profiling.timed("Track._computeAccElevationForEachTrackPoint",
+                     _numberOfTrackPoints)
     def _computeAccElevationForEachTrackPoint(self):
         """ Computes the accumulatedElevation attribute of each track point.
 
@@ -446,32 +704,23 @@ class Track:
         Ensures (as a side-effect):
             the attribute is computed for all the track points of self. 
         """
-        firstSegment = True
-        for trackSegment in self.trackSegList:
-            pointList = trackSegment.getPointList()
-            if firstSegment:
-                pointList[0].setAccumulatedElevation(0)
-                firstSegment = False
-            else: # firstSegment == False
-                verticalDistanceFromPrevious = pointList[0].getElevation() - \
-                    lastPointPrevTrkSeg.getElevation()
-                if verticalDistanceFromPrevious < 0:
-                    verticalDistanceFromPrevious = 0
-                newAccumulatedElevation = \
-                    lastPointPrevTrkSeg.getAccumulatedElevation() + \
-                        verticalDistanceFromPrevious
-                pointList[0].setAccumulatedElevation(newAccumulatedElevation)
-            for i in range(1, len(pointList)):
-                verticalDistanceFromPrevious = pointList[i].getElevation() - \
-                    pointList[i-1].getElevation()
-                if verticalDistanceFromPrevious < 0:
-                    verticalDistanceFromPrevious = 0
-                newAccumulatedElevation = \
-                    pointList[i-1].getAccumulatedElevation() + \
-                    verticalDistanceFromPrevious
-                pointList[i].setAccumulatedElevation(newAccumulatedElevation)
-            lastPointPrevTrkSeg = pointList[-1]
-
+        # the first point of each segment is measured from the last point of
+        # the previous segment
+        pointList = self._getAllTrackPoints()
+        accumulatedElevation = [0] if pointList else []
+        for i in range(1, len(pointList)):
+            verticalDistanceFromPrevious = pointList[i].getElevation() - \
+                pointList[i-1].getElevation()
+            if verticalDistanceFromPrevious < 0:
+                verticalDistanceFromPrevious = 0
+            accumulatedElevation.append(accumulatedElevation[-1] +
+                                        verticalDistanceFromPrevious)
+        for trackPoint, elevation in zip(pointList, accumulatedElevation):
+            trackPoint.setAccumulatedElevation(elevation)
+        self._getMemo()["accumulatedElevation"] = accumulatedElevation
+
+    @profiling.timed("Track._computeSpeedForEachTrackPoint",
+                     _numberOfTrackPoints)
     def _computeSpeedForEachTrackPoint(self):
         """ Computes the speed attribute of each track point.
 
@@ -485,31 +734,20 @@ class Track:
         Ensures (as a side-effect):
             the attribute is computed for all the track points of self. 
         """
-        firstSegment = True
-        for trackSegment in self.trackSegList:
-            pointList = trackSegment.getPointList()
-            if firstSegment:
-                pointList[0].setSpeed(None)  # to be assigned at the end
-                firstSegment = False
-            else: # firstSegment == False
-                distanceFromPrevious = \
-                    pointList[0].distance(lastPointPrevTrkSeg)
-                timeLapseFromPrevious = pointList[0].getTime().timeInterval(
-                    lastPointPrevTrkSeg.getTime())               
-                pointList[0].setSpeed(
-                    distanceFromPrevious/timeLapseFromPrevious)
-            for i in range(1, len(pointList)):
-                distanceFromPrevious = pointList[i].distance(pointList[i-1])
-                timeLapseFromPrevious = pointList[i].getTime().timeInterval(
-                    pointList[i-1].getTime())
-                pointList[i].setSpeed(
-                    distanceFromPrevious/timeLapseFromPrevious)
-            lastPointPrevTrkSeg = pointList[-1]
-        # go back and initialize the speed of the 1st track point as equal
-        # to the speed of the second track point
-        # assuming 1st track segment contains at least 2 track points
-        firstPointList = self.trackSegList[0].getPointList()
-        firstPointList[0].setSpeed(firstPointList[1].getSpeed())
+        pointList = self._getAllTrackPoints()
+        (stepDistance, accumulatedDistance) = kernels.consecutiveDistances(
+            [trackPoint.getLatitude() for trackPoint in pointList],
+            [trackPoint.getLongitude() for trackPoint in pointList])
+        # time differences are exact in microseconds (see Time.timeInterval)
+        speed = kernels.speeds(stepDistance,
+            [trackPoint.getEpochMicroseconds() for trackPoint in pointList],
+            timeUnit = 1000000)
+        # the speed of the 1st track point is equal to the speed of the
+        # second track point, assuming the track contains at least 2 points
+        speed = speed.tolist()
+        for trackPoint, pointSpeed in zip(pointList, speed):
+            trackPoint.setSpeed(pointSpeed)
+        self._getMemo()["speed"] = speed
 
     def getSerialized(self):
         """ Returns the track points of self in a simple list.
@@ -517,18 +755,27 @@ class Track:
         The points appear in the list in the same order as in the track,
         but they are not wrapped in a TrackSeg or a Track object.
         The accumulatedDistance attribute is initialized before the list is
-        returned.
+        returned, as are the other attributes already computed for self: the
+        values of self are set again, even if the track points were given
+        other values since (see _ensureComputed()).
         Ensures:
           a list containing the track points of self;
           each track point has its accumulatedDistance attribute initialized.
         """
         # ensure accumulatedDistance attribute is initialized
-        self._computeAccDistanceForEachTrackPoint()
-        # iterate over the trackSegs in the track, to build the resulting list          
-        result = []
-        for trackSegment in self.trackSegList:
-            result.extend(trackSegment.getPointList())
-        return result
+        self._ensureComputed("accumulatedDistance")
+        memo = self._getMemo()
+        if "serialized" not in memo:
+            memo["serialized"] = self._getAllTrackPoints()
+        for (attribute, setter) in [
+          ("accumulatedDistance", TrackPoint.setAccumulatedDistance),
+          ("accumulatedElevation", TrackPoint.setAccumulatedElevation),
+          ("speed", TrackPoint.setSpeed)]:
+            if attribute in memo:
+                for trackPoint, value in zip(memo["serialized"],
+                                             memo[attribute]):
+                    setter(trackPoint, value)
+        return list(memo["serialized"])
 
     def hidePartOfTrack(self, center_lat, center_lon, radius):
         """ Returns a new Track object resulting from deleting points from self.
@@ -541,16 +788,38 @@ class Track:
         forbidden areas, etc.
         Does not keep any track segment which ends up with less than
           2 track points.
+        The new Track holds copies of the track points that are kept, so that
+        its computed attributes do not overwrite those of self.
+        """
+        return self.hidePartsOfTrack([(center_lat, center_lon, radius)])
+
+    @profiling.timed("Track.hidePartsOfTrack", _numberOfTrackPoints)
+    def hidePartsOfTrack(self, listOfZones):
+        """ Returns a new Track object without the points in any of some zones.
+
+        Same as applying hidePartOfTrack() once for each zone, but done in a
+        single pass, testing each point only against the zones around it
+        (see kernels.pointsInZones()).
+        Requires:
+          listOfZones is a list of triples (center_lat, center_lon, radius),
+          as the arguments of hidePartOfTrack().
+        Ensures:
+          a new Track, as for hidePartOfTrack(), whose track points are those
+          of self that are not within any of the zones.
         """
         # developer's note: the minimum size of 2 for track segments should be
         # enforced in the contracts (pre-conditions) of other methods
-        centerPoint = Point(center_lat, center_lon, 0) # elevation is irrelevant
         newTrack = Track()
         for trackSegment in self.trackSegList:
+            pointList = trackSegment.getPointList()
+            hidden = kernels.pointsInZones(
+                [trackPoint.getLatitude() for trackPoint in pointList],
+                [trackPoint.getLongitude() for trackPoint in pointList],
+                listOfZones)
             newTrackSegment = TrackSeg()
-            for trackPoint in trackSegment.getPointList():
-                if trackPoint.distance(centerPoint) > radius:
-                    newTrackSegment.addPoint(trackPoint)
+            for trackPoint, isHidden in zip(pointList, hidden):
+                if not isHidden:
+                    newTrackSegment.addPoint(copy(trackPoint))
             if len(newTrackSegment.getPointList()) > 1:
                 newTrack.addTrackSeg(newTrackSegment)
         return newTrack        
@@ -567,6 +836,9 @@ class Track:
 
     def totalDistance(self):
         """ Returns the total accumulated distance of this track. """
+        memo = self._getMemo()
+        if memo.get("accumulatedDistance"):  # computed for self
+            return memo["accumulatedDistance"][-1]
         lastPoint = self.trackSegList[-1].getPointList()[-1]
         result = lastPoint.getAccumulatedDistance()
         if result == None:  # attribute has not been set
@@ -579,6 +851,9 @@ class Track:
 
         Only considers the positive contributions in elevation differences.
         """
+        memo = self._getMemo()
+        if memo.get("accumulatedElevation"):  # computed for self
+            return memo["accumulatedElevation"][-1]
         lastPoint = self.trackSegList[-1].getPointList()[-1]
         result = lastPoint.getAccumulatedElevation()
         if result == None:  # attribute has not been set
@@ -603,6 +878,126 @@ class Track:
             result = averageSpeedMetersPerSecond * 36/10
         return result
 
+    def getRangeIndex(self):
+        """ Returns the RangeIndex of self, built once per geometry.
+
+        See class RangeIndex; the index is memoized (see _getMemo()).
+        Requires: every track point of self has a time.
+        """
+        memo = self._getMemo()
+        if "rangeIndex" not in memo:
+            memo["rangeIndex"] = RangeIndex(
+              self._getDerivedAttribute("accumulatedDistance"),
+              self._getDerivedAttribute("accumulatedElevation"),
+              [trackPoint.getEpochMicroseconds()
+               for trackPoint in self._getAllTrackPoints()],
+              self._getDerivedAttribute("speed"), timeUnit = 1000000)
+        return memo["rangeIndex"]
+
+
+class RangeIndex:
+    """ Prefix sums over the track points of a track, for range statistics.
+
+    Holds, for each track point (in track order), the accumulated distance,
+    the accumulated ascent, the time and the accumulated moving time since
+    the first point. Any range of track points is then summarized in
+    constant time, from the values at its two ends, without visiting the
+    track points in between.
+    The track is considered to be moving from one point to the next when
+    the speed at the latter is above MINIMUM_MOVING_SPEED, the speed below
+    which Track.produceSeries() limits the pace.
+    """
+
+    # speed (in m/s) of a pace of 60 min/km; see Track.produceSeries()
+    MINIMUM_MOVING_SPEED = 100 / (6 * 60.0)
+
+    def __init__(self, accumulatedDistance, accumulatedElevation, times,
+                 speed, timeUnit = 1):
+        """ Builds the prefix sums.
+
+        Requires:
+          the parameters are sequences with one value per track point:
+          accumulatedDistance, accumulatedElevation and speed as the
+          attributes of TrackPoint, and times in seconds * timeUnit (e.g.
+          Time.epochMicroseconds with timeUnit = 1000000); accumulated
+          distance and times are non-decreasing.
+        """
+        self.accumulatedDistance = list(accumulatedDistance)
+        self.accumulatedElevation = list(accumulatedElevation)
+        self.times = list(times)
+        self.timeUnit = timeUnit
+        self.accumulatedMovingTime = [0]
+        for i in range(1, len(self.times)):
+            timeStep = self.times[i] - self.times[i-1]
+            if speed[i] <= self.MINIMUM_MOVING_SPEED:
+                timeStep = 0
+            self.accumulatedMovingTime.append(
+              self.accumulatedMovingTime[-1] + timeStep)
+
+    def __len__(self):
+        """ Returns the number of track points covered by self """
+        return len(self.times)
+
+    def getRange(self, firstIndex, lastIndex):
+        """ Summarizes the track between two track points, in O(1).
+
+        Requires: 0 <= firstIndex <= lastIndex < len(self).
+        Ensures:
+          a dict with
+            "firstIndex" and "lastIndex": as given;
+            "distance" (in meters), "ascent" (in meters);
+            "duration" and "movingTime" (in seconds);
+            "averagePace" and "movingPace" (in min/km, decimal pace, as
+              Track.averageSpeed()), None when distance or time is zero.
+        """
+        distance = self.accumulatedDistance[lastIndex] - \
+                   self.accumulatedDistance[firstIndex]
+        duration = (self.times[lastIndex] - self.times[firstIndex]) / \
+                   self.timeUnit
+        movingTime = (self.accumulatedMovingTime[lastIndex] -
+                      self.accumulatedMovingTime[firstIndex]) / self.timeUnit
+        def _pace(time):
+            if distance <= 0 or time <= 0:
+                return None
+            return (1/(distance/time)) * 100/6
+        return {"firstIndex": firstIndex, "lastIndex": lastIndex,
+                "distance": distance,
+                "ascent": self.accumulatedElevation[lastIndex] -
+                          self.accumulatedElevation[firstIndex],
+                "duration": duration, "movingTime": movingTime,
+                "averagePace": _pace(duration),
+                "movingPace": _pace(movingTime)}
+
+    @staticmethod
+    def _indicesWithin(values, low, high):
+        """ Returns the first and last index of values within [low, high] """
+        return (bisect_left(values, low), bisect_right(values, high) - 1)
+
+    def getRangeByDistance(self, fromDistance, toDistance):
+        """ Summarizes the track between two accumulated distances.
+
+        The range covers the track points whose accumulated distance lies
+        within [fromDistance, toDistance]; found by binary search.
+        Example: getRangeByDistance(20000, 30000) for km 20 to km 30.
+        Requires: the range contains at least one track point.
+        Ensures: the dict returned by getRange() for that range.
+        """
+        return self.getRange(*self._indicesWithin(self.accumulatedDistance,
+                                                  fromDistance, toDistance))
+
+    def getRangeByTime(self, fromSeconds, toSeconds):
+        """ Summarizes the track between two elapsed times.
+
+        The range covers the track points whose elapsed time since the first
+        point lies within [fromSeconds, toSeconds]; found by binary search.
+        Requires: the range contains at least one track point.
+        Ensures: the dict returned by getRange() for that range.
+        """
+        start = self.times[0]
+        return self.getRange(*self._indicesWithin(self.times,
+          start + fromSeconds * self.timeUnit,
+          start + toSeconds * self.timeUnit))
+
 # ----------------------------------------   
 # Further processing, analysis, statistics
 # ----------------------------------------
@@ -611,39 +1006,154 @@ class Analyse:
     """ Provides methods for GPX data processing. """
 
     @staticmethod
-    def filterSeries(series, nForAverage = 1):
+    @profiling.timed("Analyse.filterSeries",
+                     lambda series, *arguments, **keywordArguments:
+                       len(series))
+    def filterSeries(series, nForAverage = 1, filterKind = "running average"):
         """ Smooths a series (e.g., a time series) with a "low-pass" filter.
         
-        A "low-pass" filter is implemented as a running average over the
-        last nForAverage data points.
+        By default, a "low-pass" filter is implemented as a running average
+        over the last nForAverage data points.
         The parameter nForAverage denotes the number of data points
         (present + previous) used in the running average.
         If nForAverage is chosen as 1, no filtering is done (only the present
         data point is used).
+        Other kinds of filter, over windows of nForAverage data points:
+          "centered average": the average of the data points centered on the
+            present one (nForAverage // 2 previous data points, and the
+            following ones); fewer points are used near both ends;
+          "exponential": exponential smoothing, where each new y is
+            alpha * (present y) + (1 - alpha) * (previous new y), with
+            alpha = 2 / (nForAverage + 1);
+          "median": the median of the data points centered on the present
+            one, as for "centered average"; removes isolated spikes (e.g.
+            GPS glitches) instead of spreading them.
+        All the filters take O(len(series)) time, except "median", which
+        takes O(len(series) * nForAverage) time: each step inserts a value
+        into, and removes one from, a sorted list of nForAverage values.
         Requires:
           series is a list of (x,y) pairs of float;
           nForAverage is an int;
           nForAverage >= 1;
-          len(series) >= nForAverage.
+          len(series) >= nForAverage;
+          filterKind = "running average", "centered average", "exponential"
+          or "median".
         Ensures:
           a new list of (x,y) pairs of float with the same size as series;
           each x in an output (x,y) pair is unaltered when compared to the
           respective input (x,y);
-          each y in an output (x,y) pair is the average of the last nForAverage
-          values of y.
+          for "running average", each y in an output (x,y) pair is the
+          average of the last nForAverage values of y (of all the values of
+          y so far, for the first nForAverage - 1 pairs).
+        """
+        values = [pair[1] for pair in series]
+        if filterKind == "running average":
+            newValues = Analyse._runningAverage(values, nForAverage)
+        elif filterKind == "centered average":
+            newValues = Analyse._centeredAverage(values, nForAverage)
+        elif filterKind == "exponential":
+            alpha = 2 / (nForAverage + 1)
+            newValues = []
+            newYvalue = values[0] if values else None
+            for value in values:
+                newYvalue = alpha * value + (1 - alpha) * newYvalue
+                newValues.append(newYvalue)
+        else:  # filterKind == "median"
+            newValues = Analyse._centeredMedian(values, nForAverage)
+        return [(pair[0], newYvalue)
+                for pair, newYvalue in zip(series, newValues)]
+
+    @staticmethod
+    def decimateSeries(series, maximumPoints, method = "min max"):
+        """ Reduces a series to at most maximumPoints pairs, keeping its shape.
+
+        Meant for plotting series with far more points than a plot has
+        pixels; see kernels.decimationIndices() for the methods.
+        Requires:
+          series is a list of (x,y) pairs of float, with x non-decreasing;
+          maximumPoints is an int >= 4;
+          method = "min max" or "lttb".
+        Ensures:
+          a new list with at most maximumPoints of the (x,y) pairs of series,
+          in the same order; the first and last pairs are always kept.
+        """
+        indices = kernels.decimationIndices([pair[0] for pair in series],
+                                            [pair[1] for pair in series],
+                                            maximumPoints, method)
+        return [series[i] for i in indices]
+
+    @staticmethod
+    def _runningAverage(values, nForAverage):
+        """ Returns the running average of values over nForAverage values.
+
+        The sum over the window is updated as the window moves (the value
+        that enters is added, the one that leaves is subtracted), and it is
+        computed from scratch, as sum() over the window, once every
+        nForAverage values, so that rounding errors cannot build up; also
+        while it is not finite (inf or NaN values in the window).
+        The first nForAverage averages, and every nForAverage-th one after
+        them, are exactly those of sum() over the window; the others may
+        differ from them in the last bits: by at most about
+        2 * (nForAverage + 1) * 2**-53 times the largest absolute value of
+        the last two windows (below 1e-12 min/km for paces up to 60 min/km,
+        with nForAverage = 50).
         """
+        windowSum = 0.0
         result = []
-        # first phase: smoothing the first nForAverage - 1 points
-        for i in range(nForAverage - 1):
-            newYvalue = \
-              sum([series[j][1] for j in range(i+1)]) / (i+1)
-            result.append((series[i][0], newYvalue))
-        # second phase: smoothing the remaining points
-        for i in range(nForAverage - 1, len(series)):
-            newYvalue = \
-              sum([series[j][1] for j in range(i-nForAverage+1, i+1)]) / \
-                nForAverage
-            result.append((series[i][0], newYvalue))
+        for i, value in enumerate(values):
+            if i < nForAverage:  # the window is still growing
+                windowSum += value
+                result.append(windowSum / (i + 1))
+                continue
+            if i % nForAverage == 0 or not isfinite(windowSum):
+                windowSum = sum(values[i - nForAverage + 1:i + 1])
+            else:
+                windowSum += value - values[i - nForAverage]
+            result.append(windowSum / nForAverage)
+        return result
+
+    @staticmethod
+    def _centeredAverage(values, nForAverage):
+        """ Returns the centered average of values over nForAverage values.
+
+        Uses prefix sums, so each average takes constant time.
+        """
+        prefixSums = [0.0]
+        for value in values:
+            prefixSums.append(prefixSums[-1] + value)
+        before = nForAverage // 2
+        result = []
+        for i in range(len(values)):
+            first = max(i - before, 0)
+            last = min(i - before + nForAverage, len(values))  # excluded
+            result.append((prefixSums[last] - prefixSums[first]) /
+                          (last - first))
+        return result
+
+    @staticmethod
+    def _centeredMedian(values, nForAverage):
+        """ Returns the centered median of values over nForAverage values.
+
+        The window is kept sorted while it moves along values.
+        """
+        before = nForAverage // 2
+        window = []  # sorted values of the current window
+        nextIndex = 0  # index of the next value to enter the window
+        result = []
+        for i in range(len(values)):
+            last = min(i - before + nForAverage, len(values))  # excluded
+            while nextIndex < last:
+                insort(window, values[nextIndex])
+                nextIndex += 1
+            first = i - before
+            if first > 0:
+                # the value at first - 1 has just left the window
+                del window[bisect_left(window, values[first - 1])]
+            middle = len(window) // 2
+            if len(window) % 2 == 1:
+                result.append(window[middle])
+            else:
+                result.append((window[middle - 1] + window[middle]) / 2)
         return result
 
     @staticmethod
@@ -702,10 +1212,29 @@ class Analyse:
 # Future work: add further functionality: captions, titles, etc.
 
 class Plot:
-    """ Provides methods for showing data in plots. """
+    """ Provides methods for showing data in plots.
+
+    The plotting backend (pylab) is loaded on first use, so that programs
+    which do not plot never pay for importing matplotlib.
+    """
+
+    # the pylab module, once loaded (see _getBackend())
+    _backend = None
+
+    @staticmethod
+    def _getBackend():
+        """ Returns the pylab module, importing it on the first call """
+        if Plot._backend is None:
+            import pylab
+            Plot._backend = pylab
+        return Plot._backend
+
+    # default maximum number of points drawn for each set of points
+    MAXIMUM_POINTS = 2000
 
     @staticmethod
-    def add(listOfPairs, circlePoints = False, labelToUse = ""):
+    def add(listOfPairs, circlePoints = False, labelToUse = "",
+            maximumPoints = MAXIMUM_POINTS, decimation = "min max"):
         """ Adds a list of pairs to the current (eventually composite) plot.
 
         Only one current composite plot is supported at any given time.
@@ -715,16 +1244,38 @@ class Plot:
         to add (the method defined here).
         If circlePoints == True, circles are drawn around individual points.
         An optional label labelToUse can be associated with the set of points.
+        Sets with more than maximumPoints points are downsampled before being
+        drawn, with the given decimation method (see
+        Analyse.decimateSeries()), if their x is non-decreasing (e.g. a time
+        or distance series); other sets (e.g. the XY data of a route) are
+        drawn whole, since decimation would distort them. maximumPoints =
+        None draws every point.
+        Requires:
+          listOfPairs is a list of (x,y) pairs of float, or an array with
+          one row per pair (e.g. a NumPy array of shape (n, 2));
+          maximumPoints is None or an int >= 4;
+          decimation = "min max" or "lttb".
         """
         if circlePoints:
             style = '-o'
         else:
             style = '-'
+        if hasattr(listOfPairs, "shape"):  # an array: take its columns
+            x = listOfPairs[:, 0]
+            y = listOfPairs[:, 1]
+        else:
+            x = [pair[0] for pair in listOfPairs]
+            y = [pair[1] for pair in listOfPairs]
+        if maximumPoints is not None and len(x) > maximumPoints \
+           and kernels.isNonDecreasing(x):
+            indices = kernels.decimationIndices(x, y, maximumPoints,
+                                                decimation)
+            x = [x[i] for i in indices]
+            y = [y[i] for i in indices]
         # although the following line calls the method plot(), it actually
         # produces only a part of a (composite) plot
-        pylab.plot([pair[0] for pair in listOfPairs],
-                   [pair[1] for pair in listOfPairs],
-                   style, label = labelToUse)
+        pylab = Plot._getBackend()
+        pylab.plot(x, y, style, label = labelToUse)
         pylab.legend()
 
     @staticmethod
@@ -734,6 +1285,21 @@ class Plot:
         Note: in the Windows operating system, the window must be killed for
         program execution to proceed.
         """
-        pylab.show()
+        Plot._getBackend().show()
+
+    @staticmethod
+    def save(fileName):
+        """ Writes the current plot to an image file, instead of showing it.
+
+        No window is opened, so this also works without a display (e.g. with
+        the non-interactive backend selected by MPLBACKEND=Agg). Afterwards,
+        another plot may be started.
+        See also module render, to write many charts in batch.
+        Requires: fileName ends with the extension of a format supported by
+          matplotlib (e.g. ".png" or ".svg").
+        """
+        pylab = Plot._getBackend()
+        pylab.savefig(fileName)
+        pylab.clf()
 
 
@@ -0,0 +1,201 @@
+# module profiling
+
+""" Opt-in instrumentation of the processing stages: timers and counters.
+
+The main stages of GPXparser, Track, Analyse and LapExtractor are decorated
+with timed(). While profiling is enabled, each call of a stage is recorded:
+number of calls, number of points processed, wall time and, optionally,
+memory allocated (traced with tracemalloc). While it is disabled (the
+default), a decorated function only checks a flag before doing its work.
+Usage:
+  with profiling.profile(traceAllocations = True):
+      track = GPXDocument("MaratonaAveiro2019.gpx").getTrack()
+      laps = LapExtractor(track).getAutoLapsByDistance()
+  print(profiling.getReportJSON())
+The times of a stage include those of the stages it calls (e.g.
+GPXparser.buildGPXDocument includes GPXparser.parseTimeFields).
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import json
+import time
+import tracemalloc
+
+# True while profiling is enabled (see enable())
+_enabled = False
+# True if allocations are traced too
+_traceAllocations = False
+# True if tracemalloc was started by enable() (and must be stopped)
+_startedTracing = False
+# stage name -> [calls, points, seconds, allocatedBytes, peakBytes]
+_stages = {}
+# counter name -> int
+_counters = {}
+# for each stage being run, with allocations traced: [memory at its start,
+# highest peak of the stages it called]
+_allocationStack = []
+
+
+def isEnabled():
+    return _enabled
+
+
+def enable(traceAllocations = False):
+    """ Starts recording (keeping what was recorded so far).
+
+    If traceAllocations, memory allocations are also traced, with
+    tracemalloc (which slows down the program noticeably). Before Python 3.9
+    the peak of tracemalloc cannot be reset, so the peak of a stage is then
+    only an upper bound: the highest memory use since tracing started.
+    """
+    global _enabled, _traceAllocations, _startedTracing
+    _enabled = True
+    _traceAllocations = traceAllocations
+    if traceAllocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _startedTracing = True
+
+
+def disable():
+    """ Stops recording (keeping what was recorded so far) """
+    global _enabled, _traceAllocations, _startedTracing
+    if _startedTracing:
+        tracemalloc.stop()
+    _enabled = False
+    _traceAllocations = False
+    _startedTracing = False
+    del _allocationStack[:]
+
+
+def reset():
+    """ Forgets everything recorded so far """
+    _stages.clear()
+    _counters.clear()
+
+
+@contextmanager
+def profile(traceAllocations = False):
+    """ Records (from scratch) what runs within a with statement.
+
+    See enable(). The report is available after the with statement, until
+    the next reset().
+    """
+    reset()
+    enable(traceAllocations)
+    try:
+        yield
+    finally:
+        disable()
+
+
+def count(name, amount = 1):
+    """ Adds amount to a counter, if profiling is enabled """
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def _record(name, seconds, points, allocatedBytes, peakBytes):
+    figures = _stages.get(name)
+    if figures is None:
+        figures = _stages[name] = [0, 0, 0.0, 0, 0]
+    figures[0] += 1
+    figures[1] += points
+    figures[2] += seconds
+    figures[3] += allocatedBytes
+    figures[4] = max(figures[4], peakBytes)
+
+
+@contextmanager
+def stage(name, points = 0):
+    """ Records a block of code as a call of a stage, if profiling is enabled.
+
+    Requires: points is the number of points the block processes.
+    """
+    if not _enabled:
+        yield
+        return
+    start = _startStage()
+    try:
+        yield
+    finally:
+        _endStage(name, start, points)
+
+
+def _startStage():
+    """ Returns the start time of a stage, and starts tracing its memory """
+    if _traceAllocations:
+        (current, peak) = tracemalloc.get_traced_memory()
+        if _allocationStack:  # the peak of the calling stage, so far
+            _allocationStack[-1][1] = max(_allocationStack[-1][1], peak)
+        _allocationStack.append([current, 0])
+        if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+            tracemalloc.reset_peak()
+    return time.perf_counter()
+
+
+def _endStage(name, start, points, end = None):
+    """ Records a call of a stage that started at start and ended at end
+    (now, if None) """
+    seconds = (end if end is not None else time.perf_counter()) - start
+    allocatedBytes = 0
+    peakBytes = 0
+    if _traceAllocations and _allocationStack:
+        (current, peak) = tracemalloc.get_traced_memory()
+        (startMemory, childrenPeak) = _allocationStack.pop()
+        peak = max(peak, childrenPeak)
+        allocatedBytes = current - startMemory
+        peakBytes = peak - startMemory
+        if _allocationStack:  # the calling stage must see this peak too
+            _allocationStack[-1][1] = max(_allocationStack[-1][1], peak)
+    _record(name, seconds, points, allocatedBytes, peakBytes)
+
+
+def timed(name, points = None):
+    """ Decorator: records each call of a function as a call of a stage.
+
+    Requires: points is None, or a function that takes the same arguments
+      as the decorated function and returns the number of points processed
+      by the call (it is only called when profiling is enabled, after the
+      decorated function).
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = _startStage()
+            end = None
+            try:
+                result = function(*args, **kwargs)
+                end = time.perf_counter()
+                return result
+            finally:
+                # points are only counted if the call succeeded
+                _endStage(name, start, points(*args, **kwargs)
+                          if end is not None and points is not None else 0,
+                          end)
+        return wrapper
+    return decorator
+
+
+def getReport():
+    """ Returns what was recorded, as a dict.
+
+    Ensures: a dict with
+      "stages": for each stage name, a dict with "calls", "points",
+        "seconds", and (if allocations were traced) "allocatedBytes" (net,
+        summed over calls) and "peakBytes" (the highest of all calls);
+      "counters": for each counter name, its value.
+    """
+    stages = {}
+    for (name, figures) in sorted(_stages.items()):
+        stages[name] = {"calls": figures[0], "points": figures[1],
+                        "seconds": figures[2],
+                        "allocatedBytes": figures[3], "peakBytes": figures[4]}
+    return {"stages": stages, "counters": dict(_counters)}
+
+
+def getReportJSON():
+    """ Returns getReport() as a JSON string """
+    return json.dumps(getReport(), indent = 1)
@@ -0,0 +1,486 @@
+# module regression
+
+""" Regression harness: checks results and speed against stored references.
+
+Four kinds of checks are made:
+  pipelines: test_client_for_laps.py and app_laps.py are run (each in a new
+    process, headless) and the numbers they print are compared, in order,
+    with those of output_from_test_client.txt and output_from_app.txt,
+    within numeric tolerances (the wording and layout of the lines are not
+    compared);
+  engines: the laps of the bundled files are computed with each engine
+    (LapExtractor over Track, getLapSummaries(), the trackcache cache,
+    TrackArray, LapTracker) and compared with those of the reference engine
+    (LapExtractor over Track): the split points must be the same, and the
+    lap distances and times, and the sums of lap distances, equal within
+    the tolerances;
+  lap views: for every auto-lap of the bundled files, the public methods of
+    Track give the same results, within the tolerances, on the LapView
+    returned by LapExtractor and on a Lap made of copies of its track
+    points;
+  shared points: after a Lap made of some of the track points of a track
+    (as test_client_for_laps.py does) has computed its own attributes on
+    them, the track, the laps already returned and a new LapExtractor over
+    the track give the same results as before.
+Each check is also timed (best of several runs) and fails if it is more than
+a given factor slower than in the stored baseline. So that the baseline can
+be kept in the repository and used on any machine, it holds the time of each
+check divided by the time of a calibration workload (see calibrate()), run
+on the same machine; there is one set of such ratios with NumPy and one
+without (see kernels). A baseline is never written implicitly: a missing
+baseline, or a check missing from it, is a failure. The baseline of the
+current backend is replaced with --update-baseline (only if every check
+passes), after a change that is meant to change the times.
+
+Usage:
+  python regression.py [--max-slowdown 1.5] [--tolerance 1e-9]
+                       [--repeat 3] [--baseline regression_baseline.json]
+                       [--update-baseline]
+"""
+
+import argparse
+from copy import copy
+import gc
+import json
+from math import cos, sin, sqrt
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import GPXparser
+import kernels
+from laps import Lap, LapExtractor, LapTracker
+from myPyGPX import GPXDocument
+
+# the directory of the project, where the scripts and references are
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# (name, script, reference output)
+PIPELINES = [("test client", "test_client_for_laps.py",
+              "output_from_test_client.txt"),
+             ("app laps", "app_laps.py", "output_from_app.txt")]
+
+# the files whose laps are checked for every engine (they need times)
+ENGINE_FILES = ["FR935-25_04_2018_dois_trksegs_com_waypoints.gpx",
+                "MaratonaAveiro2019.gpx"]
+
+# the lap schemes checked, as for LapExtractor.getLapSummaries()
+LAP_SCHEMES = [("distance", 998.03), ("time", 240.0),
+               ("distance markers", [5000, 10000, 21097.5, 100000]),
+               ("time markers", [3600, 7200, 10800, 100000])]
+
+DEFAULT_MAX_SLOWDOWN = 1.5
+DEFAULT_TOLERANCE = 1e-9
+DEFAULT_REPEAT = 3
+DEFAULT_BASELINE = "regression_baseline.json"
+
+# the backend of kernels, which has its own ratios in the baseline
+BACKEND = "numpy" if kernels.numpy is not None else "pure python"
+
+_NUMBER = re.compile(r"[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?")
+
+
+def extractNumbers(text):
+    """ Returns the list of all the numbers in a text, in order, as float """
+    return [float(number) for number in _NUMBER.findall(text)]
+
+
+def isClose(value, reference, tolerance):
+    """ True if value equals reference within a relative or absolute
+    tolerance """
+    return abs(value - reference) <= tolerance * max(1.0, abs(reference))
+
+
+def compareNumbers(numbers, referenceNumbers, tolerance):
+    """ Compares two lists of numbers.
+
+    Ensures: None if they have the same length and each number is close to
+      the corresponding reference (see isClose()); otherwise, a string
+      describing the first difference.
+    """
+    if len(numbers) != len(referenceNumbers):
+        return "found " + str(len(numbers)) + " numbers, expected " + \
+               str(len(referenceNumbers))
+    for i in range(len(numbers)):
+        if not isClose(numbers[i], referenceNumbers[i], tolerance):
+            return "number " + str(i) + " is " + repr(numbers[i]) + \
+                   ", expected " + repr(referenceNumbers[i])
+    return None
+
+
+def runPipeline(script):
+    """ Runs a script of the project in a new process, without display.
+
+    Ensures: the text printed by the script.
+    """
+    environment = dict(os.environ, MPLBACKEND = "Agg")
+    return subprocess.run([sys.executable, script], cwd = PROJECT_DIRECTORY,
+                          env = environment, check = True,
+                          capture_output = True, text = True).stdout
+
+
+def _lapFigures(laps):
+    """ Returns the (index range, distance, time) of each lap of a list """
+    return [(lap.getIndexRange(), lap.totalDistance(), lap.totalTime())
+            for lap in laps]
+
+
+def _extractorLaps(lapExtractor):
+    """ Returns the figures of the laps of each of LAP_SCHEMES, with the
+    methods of LapExtractor that return laps """
+    methods = {"distance": lapExtractor.getAutoLapsByDistance,
+               "time": lapExtractor.getAutoLapsByTime,
+               "distance markers":
+                 lapExtractor.getLapsFromListOfDistanceMarkers,
+               "time markers": lapExtractor.getLapsFromListOfTimeMarkers}
+    return [_lapFigures(methods[splitBy](value))
+            for (splitBy, value) in LAP_SCHEMES]
+
+
+def _engineTrack(gpxFileName):
+    return _extractorLaps(LapExtractor(GPXDocument(gpxFileName).getTrack()))
+
+
+def _engineLapSummaries(gpxFileName):
+    lapExtractor = LapExtractor(GPXDocument(gpxFileName).getTrack())
+    return [_lapFigures(laps)
+            for laps in lapExtractor.getLapSummaries(LAP_SCHEMES)]
+
+
+# the cache directory of _engineCache(), where runChecks() writes the cache
+# files beforehand, so that only loads from a valid cache file are timed
+_cacheDirectory = None
+
+
+def _engineCache(gpxFileName):
+    track = GPXDocument(gpxFileName, _cacheDirectory).getTrack()
+    return _extractorLaps(LapExtractor(track))
+
+
+def _engineTrackArray(gpxFileName):
+    from trackarray import TrackArray
+    return _extractorLaps(LapExtractor(TrackArray.fromGPXFile(gpxFileName)))
+
+
+def _engineLapTracker(gpxFileName):
+    """ Only for the auto-lap schemes; None for the others """
+    result = []
+    for (splitBy, value) in LAP_SCHEMES:
+        if splitBy in ("distance", "time"):
+            lapTracker = LapTracker(splitBy, value)
+            laps = list(lapTracker.feed(GPXparser.iterTrackPoints(gpxFileName)))
+            lastLap = lapTracker.finish()
+            if lastLap is not None:
+                laps.append(lastLap)
+            result.append(_lapFigures(laps))
+        else:
+            result.append(None)
+    return result
+
+
+# (name, function from a GPX file name to the figures of its laps); the
+# first one is the reference
+ENGINES = [("LapExtractor over Track", _engineTrack),
+           ("LapExtractor.getLapSummaries", _engineLapSummaries),
+           ("trackcache", _engineCache),
+           ("LapTracker", _engineLapTracker)]
+if kernels.numpy is not None:  # TrackArray requires NumPy
+    ENGINES.insert(3, ("TrackArray", _engineTrackArray))
+
+
+def compareLaps(figures, referenceFigures, tolerance):
+    """ Compares the figures of the laps of an engine with the reference.
+
+    Ensures: None if they agree (see the module docstring); otherwise, a
+      string describing the first difference.
+    """
+    for k in range(len(LAP_SCHEMES)):
+        if figures[k] is None:  # scheme not supported by the engine
+            continue
+        scheme = LAP_SCHEMES[k][0]
+        laps = figures[k]
+        referenceLaps = referenceFigures[k]
+        if [lap[0] for lap in laps] != [lap[0] for lap in referenceLaps]:
+            return scheme + ": the split points differ"
+        for i in range(len(laps)):
+            for (position, name) in [(1, "distance"), (2, "time")]:
+                if not isClose(laps[i][position], referenceLaps[i][position],
+                               tolerance):
+                    return scheme + ": lap " + str(i + 1) + " " + name + \
+                           " is " + repr(laps[i][position]) + ", expected " + \
+                           repr(referenceLaps[i][position])
+        if not isClose(sum(lap[1] for lap in laps),
+                       sum(lap[1] for lap in referenceLaps), tolerance):
+            return scheme + ": the sum of lap distances differs"
+    return None
+
+
+def _lapAPIFigures(lap):
+    """ Returns the results of the public methods of Track for a lap, as a
+    list of (name, number) pairs """
+    figures = [("lap number", lap.getLapNumber()),
+               ("starting distance", lap.getStartingDistance()),
+               ("start time", lap.getStartTime().epochMicroseconds),
+               ("finish time", lap.getFinishTime().epochMicroseconds),
+               ("totalTime", lap.totalTime()),
+               ("totalDistance", lap.totalDistance()),
+               ("totalAccumulatedElevation", lap.totalAccumulatedElevation()),
+               ("averageSpeed", lap.averageSpeed()),
+               ("averageSpeed km/h", lap.averageSpeed("speed km/h"))]
+    for arrangeAs in ("time series", "distance series"):
+        for dataKind in ("pace", "speed km/h", "elevation"):
+            for (i, (x, y)) in enumerate(lap.produceSeries(arrangeAs,
+                                                           dataKind)):
+                figures += [(arrangeAs + " " + dataKind + " x" + str(i), x),
+                            (arrangeAs + " " + dataKind + " y" + str(i), y)]
+    for (i, (x, y)) in enumerate(lap.produceXYdata()):
+        figures += [("XY x" + str(i), x), ("XY y" + str(i), y)]
+    for (i, trackPoint) in enumerate(lap.getSerialized()):
+        figures.append(("getSerialized distance " + str(i),
+                        trackPoint.getAccumulatedDistance()))
+    figures.append(("getTrackSegList points",
+                    sum(len(trackSegment.getPointList())
+                        for trackSegment in lap.getTrackSegList())))
+    rangeIndex = lap.getRangeIndex()
+    for (name, value) in sorted(rangeIndex.getRange(0, len(rangeIndex) - 1)
+                                .items()):
+        figures.append(("getRangeIndex " + name,
+                        value if value is not None else -1))
+    for (name, pair) in [("getFastestPace", lap.getFastestPace(5)),
+                         ("getSlowestPace", lap.getSlowestPace(5, "time"))]:
+        figures += [(name + " location", pair[0]), (name, pair[1])]
+    middlePoint = lap.produceXYdata()[len(lap.produceXYdata()) // 2]
+    hiddenTrack = lap.hidePartOfTrack(middlePoint[1], middlePoint[0], 50)
+    figures.append(("hidePartOfTrack points",
+                    len(hiddenTrack.getSerialized())))
+    return figures
+
+
+def compareLapViews(gpxFileName, tolerance):
+    """ Compares the LapView objects of the auto-laps of a file with Lap.
+
+    Ensures: None if, for every lap, the public methods of Track give the
+      same results (see isClose()) on the LapView and on a Lap made of
+      copies of its track points (with their attributes measured from the
+      beginning of the lap); otherwise, a string describing the first
+      difference.
+    """
+    lapExtractor = LapExtractor(GPXDocument(gpxFileName).getTrack())
+    serializedTrack = lapExtractor.getSerializedTrack()
+    for lapView in lapExtractor.getAutoLapsByDistance():
+        (firstIndex, lastIndex) = lapView.getIndexRange()
+        # as LapExtractor made laps before LapView: copies whose distance
+        # is measured from the beginning of the lap, and whose ascent and
+        # speed are left to be computed within the lap
+        listOfPoints = [copy(trackPoint) for trackPoint in
+                        serializedTrack[firstIndex:lastIndex + 1]]
+        for trackPoint in listOfPoints:
+            trackPoint.setAccumulatedDistance(
+              trackPoint.getAccumulatedDistance() -
+              lapView.getStartingDistance())
+            trackPoint.setAccumulatedElevation(None)
+            trackPoint.setSpeed(None)
+        lap = Lap(lapView.getLapNumber(), lapView.getStartingDistance(),
+                  listOfPoints)
+        figures = _lapAPIFigures(lapView)
+        referenceFigures = _lapAPIFigures(lap)
+        if [name for (name, value) in figures] != \
+           [name for (name, value) in referenceFigures]:
+            return "lap " + str(lap.getLapNumber()) + ": the results differ"
+        for ((name, value), (referenceName, referenceValue)) in \
+          zip(figures, referenceFigures):
+            if not isClose(value, referenceValue, tolerance):
+                return "lap " + str(lap.getLapNumber()) + " " + name + \
+                       " is " + repr(value) + ", expected " + \
+                       repr(referenceValue)
+    return None
+
+
+def compareSharedPoints(gpxFileName, tolerance):
+    """ Checks that a Lap sharing track points with a track leaves it intact.
+
+    Ensures: None if, after a Lap made of the middle third of the serialized
+      track has computed its pace (which sets its own attributes on the
+      shared track points), the distances of getSerialized(), the laps
+      returned before and the laps of a new LapExtractor are the same as
+      before (see compareLaps()); otherwise, a string describing the first
+      difference.
+    """
+    track = GPXDocument(gpxFileName).getTrack()
+    serializedTrack = track.getSerialized()
+    distances = [trackPoint.getAccumulatedDistance()
+                 for trackPoint in serializedTrack]
+    # the laps of the first of LAP_SCHEMES ("distance"), kept
+    lapViews = LapExtractor(track).getAutoLapsByDistance(LAP_SCHEMES[0][1])
+    lapViewFigures = [_lapFigures(lapViews)] + [None] * (len(LAP_SCHEMES) - 1)
+    referenceFigures = _extractorLaps(LapExtractor(track))
+    third = len(serializedTrack) // 3
+    Lap(1, 0, serializedTrack[third:2 * third]).getFastestPace(5)
+    error = compareLaps([_lapFigures(lapViews)] + lapViewFigures[1:],
+                        lapViewFigures, tolerance)
+    if error is not None:
+        return "laps returned before: " + error
+    for (i, trackPoint) in enumerate(track.getSerialized()):
+        if not isClose(trackPoint.getAccumulatedDistance(), distances[i],
+                       tolerance):
+            return "getSerialized distance " + str(i) + " is " + \
+                   repr(trackPoint.getAccumulatedDistance()) + \
+                   ", expected " + repr(distances[i])
+    return compareLaps(_extractorLaps(LapExtractor(track)), referenceFigures,
+                       tolerance)
+
+
+def timeBest(function, repeat):
+    """ Runs function repeat times; returns (its last result, best time) """
+    bestTime = None
+    for i in range(repeat):
+        gc.collect()  # so that no run pays for the garbage of another
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if bestTime is None or elapsed < bestTime:
+            bestTime = elapsed
+    return (result, bestTime)
+
+
+def _calibrationWork():
+    """ A fixed workload in pure Python, which does not use the project """
+    total = 0.0
+    for i in range(300000):
+        x = i * 1e-5
+        total += sin(x) * cos(x) + sqrt(x)
+    values = [(i * 7919) % 100003 for i in range(200000)]
+    values.sort()
+    return total + values[-1]
+
+
+def calibrate(repeat = DEFAULT_REPEAT):
+    """ Returns the time of the calibration workload on this machine.
+
+    The times of the checks are stored relative to it in the baseline.
+    Ensures: the best of max(repeat, 3) runs, in seconds.
+    """
+    return timeBest(_calibrationWork, max(repeat, 3))[1]
+
+
+def _runEngineChecks(gpxFileName, tolerance, repeat):
+    """ Runs the checks of the engines, of the lap views and of the shared
+    points for one file.
+
+    Ensures: a list of dicts, as for runChecks().
+    """
+    checks = []
+    gpxPath = os.path.join(PROJECT_DIRECTORY, gpxFileName)
+    referenceFigures = None
+    for (name, engine) in ENGINES:
+        try:
+            (figures, seconds) = timeBest(lambda: engine(gpxPath), repeat)
+            if referenceFigures is None:
+                referenceFigures = figures
+            error = compareLaps(figures, referenceFigures, tolerance)
+        except Exception as exception:
+            (seconds, error) = (None, type(exception).__name__ + ": " +
+                                      str(exception))
+        checks.append({"name": "engine " + name + " / " + gpxFileName,
+                       "seconds": seconds, "error": error})
+    for (name, compare) in [("lap views", compareLapViews),
+                            ("shared points", compareSharedPoints)]:
+        try:
+            (error, seconds) = timeBest(
+              lambda: compare(gpxPath, tolerance), repeat)
+        except Exception as exception:
+            (seconds, error) = (None, type(exception).__name__ + ": " +
+                                      str(exception))
+        checks.append({"name": name + " / " + gpxFileName,
+                       "seconds": seconds, "error": error})
+    return checks
+
+
+def runChecks(tolerance = DEFAULT_TOLERANCE, repeat = DEFAULT_REPEAT):
+    """ Runs all the checks, without comparing times with the baseline.
+
+    Ensures: a list of dicts with "name", "seconds" and "error" (None if the
+      results are correct), one per pipeline and per engine and file.
+    """
+    global _cacheDirectory
+    checks = []
+    for (name, script, referenceFileName) in PIPELINES:
+        with open(os.path.join(PROJECT_DIRECTORY, referenceFileName),
+                  encoding = "utf-8") as referenceFile:
+            referenceNumbers = extractNumbers(referenceFile.read())
+        try:
+            (output, seconds) = timeBest(lambda: runPipeline(script), repeat)
+            error = compareNumbers(extractNumbers(output), referenceNumbers,
+                                   tolerance)
+        except subprocess.CalledProcessError as exception:
+            (seconds, error) = (None, "failed: " + exception.stderr[-300:])
+        checks.append({"name": "pipeline " + name, "seconds": seconds,
+                       "error": error})
+    with tempfile.TemporaryDirectory() as _cacheDirectory:
+        for gpxFileName in ENGINE_FILES:
+            GPXDocument(os.path.join(PROJECT_DIRECTORY, gpxFileName),
+                        _cacheDirectory)  # writes the cache file
+            checks += _runEngineChecks(gpxFileName, tolerance, repeat)
+    return checks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Regression harness")
+    parser.add_argument("--max-slowdown", type = float,
+                        default = DEFAULT_MAX_SLOWDOWN,
+                        help = "fail if a check is this many times slower "
+                               "than in the baseline")
+    parser.add_argument("--tolerance", type = float,
+                        default = DEFAULT_TOLERANCE,
+                        help = "relative (or absolute, below 1) tolerance")
+    parser.add_argument("--repeat", type = int, default = DEFAULT_REPEAT)
+    parser.add_argument("--baseline", default = os.path.join(
+                          PROJECT_DIRECTORY, DEFAULT_BASELINE))
+    parser.add_argument("--update-baseline", action = "store_true",
+                        help = "replace the baseline of the current backend "
+                               "(if every check passes)")
+    arguments = parser.parse_args()
+    # calibrated before and after the checks, so that the calibration does
+    # not depend on when the machine was busy
+    calibration = calibrate(arguments.repeat)
+    checks = runChecks(arguments.tolerance, arguments.repeat)
+    calibration = min(calibration, calibrate(arguments.repeat))
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+    ratios = baseline.get(BACKEND, {})
+    failed = False
+    for check in checks:
+        status = "PASS"
+        detail = ""
+        if check["error"] is not None:
+            (status, detail) = ("FAIL", check["error"])
+        elif arguments.update_baseline:
+            pass
+        elif check["name"] not in ratios:
+            (status, detail) = ("FAIL", "not in the baseline")
+        else:
+            ratio = check["seconds"] / calibration / ratios[check["name"]]
+            detail = "{:.2f}x baseline".format(ratio)
+            if ratio > arguments.max_slowdown:
+                status = "SLOW"
+        failed = failed or status != "PASS"
+        seconds = "{:8.4f} s".format(check["seconds"]) \
+                  if check["seconds"] is not None else "       -  "
+        print(status, seconds, check["name"], detail)
+    if arguments.update_baseline and not failed:
+        baseline[BACKEND] = dict((check["name"],
+                                  check["seconds"] / calibration)
+                                 for check in checks)
+        with open(arguments.baseline, "w") as baselineFile:
+            json.dump(baseline, baselineFile, indent = 1, sort_keys = True)
+            baselineFile.write("\n")
+        print("Baseline of", BACKEND, "saved in", arguments.baseline)
+    elif not ratios:
+        print("No baseline of", BACKEND, "in", arguments.baseline,
+              "(see --update-baseline)")
+    sys.exit(1 if failed else 0)
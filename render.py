@@ -0,0 +1,206 @@
+# module render
+
+""" Headless rendering of charts of activities and laps to image files.
+
+Unlike Plot, which draws with pylab and shows a window, this module draws on
+a matplotlib Figure with the non-interactive Agg canvas, and writes PNG or
+SVG files; no window or display is needed. A ChartRenderer keeps a single
+figure and axes and clears them between charts, instead of creating new
+ones for each chart; each worker process of renderFiles() keeps its own
+ChartRenderer for all of its files.
+
+Usage from the command line:
+  python render.py <directory or glob pattern> <output directory>
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+
+from batch import findGPXFiles, getAvailableCores
+import kernels
+from laps import LapExtractor
+from myPyGPX import Analyse, GPXDocument, Plot
+
+# for each kind of chart: (dataKind for produceSeries(), label of the y axis)
+DATA_KINDS = {"pace": ("pace", "Pace (min/km)"),
+              "speed": ("speed km/h", "Speed (km/h)"),
+              "elevation": ("elevation", "Elevation (m)")}
+
+# label of the x axis for each arrangement of a series
+X_LABELS = {"distance series": "Distance (m)", "time series": "Time (s)"}
+
+
+class ChartRenderer:
+    """ Draws line charts into image files, reusing one figure and axes. """
+
+    def __init__(self, width = 8, height = 5, dpi = 100):
+        """ Creates the figure and axes (size in inches, at dpi pixels/inch).
+
+        Requires: matplotlib is installed.
+        """
+        # imported here, so that importing this module stays cheap
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        self.figure = Figure(figsize = (width, height), dpi = dpi)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+
+    def render(self, fileName, listOfSeries, listOfLabels = None,
+               title = "", xLabel = "", yLabel = "",
+               maximumPoints = Plot.MAXIMUM_POINTS):
+        """ Draws some series as lines, and writes the chart to a file.
+
+        Series with more than maximumPoints points are downsampled as in
+        Plot.add() (only if their x is non-decreasing).
+        Requires:
+          fileName ends with the extension of the image format (e.g. ".png"
+          or ".svg");
+          listOfSeries is a list of lists of (x,y) pairs of float;
+          listOfLabels is None or a list with a label for each series.
+        Ensures: the file is created (or replaced).
+        """
+        self.axes.clear()
+        for i in range(len(listOfSeries)):
+            series = listOfSeries[i]
+            x = [pair[0] for pair in series]
+            y = [pair[1] for pair in series]
+            if maximumPoints is not None and len(x) > maximumPoints \
+               and kernels.isNonDecreasing(x):
+                indices = kernels.decimationIndices(x, y, maximumPoints)
+                x = [x[j] for j in indices]
+                y = [y[j] for j in indices]
+            label = listOfLabels[i] if listOfLabels is not None else None
+            self.axes.plot(x, y, "-", label = label)
+        if listOfLabels is not None:
+            self.axes.legend()
+        self.axes.set_title(title)
+        self.axes.set_xlabel(xLabel)
+        self.axes.set_ylabel(yLabel)
+        self.figure.savefig(fileName)
+
+
+def _getOutputFileName(gpxFileName, outputDirectory, chartName, fileFormat):
+    """ Returns the name of the image file of a chart of a GPX file """
+    baseName = os.path.splitext(os.path.basename(gpxFileName))[0]
+    return os.path.join(outputDirectory,
+                        baseName + "_" + chartName + "." + fileFormat)
+
+
+def renderActivity(gpxFileName, outputDirectory, renderer,
+                   dataKinds = ("pace", "speed", "elevation"),
+                   lapNumbers = None, arrangeAs = "distance series",
+                   nForAverage = 5, fileFormat = "png"):
+    """ Writes the charts of the track of a GPX file.
+
+    For each of dataKinds, a chart of the whole track is written; if
+    lapNumbers is given, a chart comparing those laps (auto-laps by
+    distance; see LapExtractor.getAutoLapsByDistance()) is also written for
+    each of dataKinds, as app_laps.py does for pace. The series are filtered
+    with Analyse.filterSeries(nForAverage).
+    Requires:
+      renderer is a ChartRenderer;
+      dataKinds contains keys of DATA_KINDS;
+      lapNumbers is None or a list of lap numbers;
+      arrangeAs = "time series" or "distance series";
+      fileFormat = "png" or "svg".
+    Ensures: the list of the names of the files written, in outputDirectory.
+    """
+    track = GPXDocument(gpxFileName).getTrack()
+    baseName = os.path.basename(gpxFileName)
+    listOfFileNames = []
+    listOfLaps = []
+    if lapNumbers is not None:
+        listOfLaps = [lap for lap in LapExtractor(track).getAutoLapsByDistance()
+                      if lap.getLapNumber() in lapNumbers]
+    for dataKind in dataKinds:
+        (seriesKind, yLabel) = DATA_KINDS[dataKind]
+        series = Analyse.filterSeries(
+          track.produceSeries(arrangeAs, seriesKind), nForAverage)
+        fileName = _getOutputFileName(gpxFileName, outputDirectory, dataKind,
+                                      fileFormat)
+        renderer.render(fileName, [series], title = baseName,
+                        xLabel = X_LABELS[arrangeAs], yLabel = yLabel)
+        listOfFileNames.append(fileName)
+        if listOfLaps:
+            listOfSeries = [Analyse.filterSeries(
+                              lap.produceSeries(arrangeAs, seriesKind),
+                              nForAverage)
+                            for lap in listOfLaps]
+            fileName = _getOutputFileName(gpxFileName, outputDirectory,
+                                          "laps_" + dataKind, fileFormat)
+            renderer.render(fileName, listOfSeries,
+                            [lap.getLapNumber() for lap in listOfLaps],
+                            title = baseName, xLabel = X_LABELS[arrangeAs],
+                            yLabel = yLabel)
+            listOfFileNames.append(fileName)
+    return listOfFileNames
+
+
+# the ChartRenderer of this process (see _renderActivityTask())
+_renderer = None
+
+
+def _renderActivityTask(task):
+    """ Runs renderActivity() in a worker, with the renderer of the process.
+
+    task is a pair (gpxFileName, dict of the other arguments).
+    Ensures: a triple (gpxFileName, list of file names written, error), where
+      error is None or a string describing why the rendering failed.
+    """
+    global _renderer
+    (gpxFileName, arguments) = task
+    try:
+        if _renderer is None:
+            _renderer = ChartRenderer()
+        return (gpxFileName,
+                renderActivity(gpxFileName, renderer = _renderer, **arguments),
+                None)
+    except Exception as exception:
+        return (gpxFileName, [],
+                type(exception).__name__ + ": " + str(exception))
+
+
+def renderFiles(directoryOrPattern, outputDirectory,
+                dataKinds = ("pace", "speed", "elevation"), lapNumbers = None,
+                arrangeAs = "distance series", nForAverage = 5,
+                fileFormat = "png", numberOfProcesses = None):
+    """ Writes the charts of all the GPX files of a directory, in parallel.
+
+    Each file is rendered by renderActivity() in one of numberOfProcesses
+    worker processes (as batch.analyseFiles() does).
+    Requires:
+      directoryOrPattern is as for batch.findGPXFiles();
+      the other arguments are as for renderActivity(), and numberOfProcesses
+      as for batch.analyseFiles().
+    Ensures: a list with a triple (gpxFileName, list of file names written,
+      error) for each GPX file, as for _renderActivityTask().
+    """
+    os.makedirs(outputDirectory, exist_ok = True)
+    arguments = {"outputDirectory": outputDirectory, "dataKinds": dataKinds,
+                 "lapNumbers": lapNumbers, "arrangeAs": arrangeAs,
+                 "nForAverage": nForAverage, "fileFormat": fileFormat}
+    tasks = [(fileName, arguments)
+             for fileName in findGPXFiles(directoryOrPattern)]
+    if numberOfProcesses is None:
+        numberOfProcesses = getAvailableCores()
+    numberOfProcesses = min(numberOfProcesses, len(tasks))
+    if numberOfProcesses <= 1:
+        return [_renderActivityTask(task) for task in tasks]
+    chunkSize = max(1, len(tasks) // (numberOfProcesses * 4))
+    with ProcessPoolExecutor(numberOfProcesses) as executor:
+        return list(executor.map(_renderActivityTask, tasks,
+                                 chunksize = chunkSize))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python render.py <directory or glob pattern>"
+              " <output directory>")
+        sys.exit(1)
+    for (gpxFileName, listOfFileNames, error) in \
+      renderFiles(sys.argv[1], sys.argv[2]):
+        if error is not None:
+            print(gpxFileName, "- Error:", error)
+        else:
+            print(gpxFileName, "->", ", ".join(listOfFileNames))
@@ -0,0 +1,328 @@
+# module trackarray
+
+""" Provides a columnar, NumPy-backed alternative storage engine for Track. """
+
+from array import array
+
+import numpy
+
+import GPXparser
+import kernels
+from myPyGPX import RangeIndex, Time, Track, TrackSeg, TrackPoint
+
+
+class TrackArray:
+    """ Representation of a GPX track as contiguous columns of float64.
+
+    Instead of one TrackPoint object per point, a TrackArray holds one array
+    per attribute, all with one entry per track point, in track order:
+      lat, lon and elevation (as read from the GPX file);
+      elapsedTime: seconds since the first point of the track (NaN when
+        the point has no time); the absolute start is kept in
+        startEpochMicroseconds (see Time.epochMicroseconds);
+      accumulatedDistance, accumulatedElevation and speed: the derived
+        attributes of TrackPoint, computed once at creation.
+    Track segments are given by segmentOffsets: segment k holds the points
+    segmentOffsets[k] up to (excluding) segmentOffsets[k+1].
+    A TrackArray is not modified after creation; it offers the same public
+    methods as Track (except addTrackSeg), so it can be used in its place.
+    """
+
+    def __init__(self, lat, lon, elevation, elapsedTime,
+                 startEpochMicroseconds, segmentOffsets, derivedColumns = None):
+        """ Initializes the columns and computes the derived ones.
+
+        Requires:
+          lat, lon, elevation and elapsedTime are sequences of float with the
+          same length (see the class docstring);
+          startEpochMicroseconds is an int, or None if there are no times;
+          segmentOffsets is a non-decreasing sequence of int starting with 0
+          and ending with the number of points;
+          derivedColumns is None, or a tuple (accumulatedDistance,
+          accumulatedElevation, speed) of sequences already computed for
+          these points (e.g. read from a cache), which are then used as is.
+        """
+        self.lat = numpy.asarray(lat, dtype = numpy.float64)
+        self.lon = numpy.asarray(lon, dtype = numpy.float64)
+        self.elevation = numpy.asarray(elevation, dtype = numpy.float64)
+        self.elapsedTime = numpy.asarray(elapsedTime, dtype = numpy.float64)
+        self.startEpochMicroseconds = startEpochMicroseconds
+        self.segmentOffsets = numpy.asarray(segmentOffsets, dtype = numpy.int64)
+        self._rangeIndex = None  # built by getRangeIndex()
+        if derivedColumns is None:
+            self._computeDerivedColumns()
+        else:
+            (self.accumulatedDistance, self.accumulatedElevation,
+             self.speed) = [numpy.asarray(column, dtype = numpy.float64)
+                            for column in derivedColumns]
+
+    @classmethod
+    def fromTrack(cls, track):
+        """ Creates a TrackArray with the track points of a Track.
+
+        Requires: track is an instance of Track.
+        """
+        return cls._fromTrackSegs([trackSegment.getPointList()
+                                   for trackSegment in track.trackSegList])
+
+    @classmethod
+    def fromGPXFile(cls, gpxFileName, parseProfile = "track"):
+        """ Creates a TrackArray directly from the track of a GPX file.
+
+        The file is streamed (see GPXparser.iterGPXElements()) and no
+        TrackPoint is kept, so memory is proportional to the columns only.
+        Requires:
+          gpxFileName is a string that names a reachable GPX file;
+          this file contains at most 1 track;
+          parseProfile is as for GPXparser.iterGPXElements() (names and
+          descriptions are not kept, so "track" decodes all that is used).
+        """
+        columns = _ColumnBuilder()
+        for (tag, value) in GPXparser.iterGPXElements(gpxFileName,
+                                                      parseProfile):
+            if tag == "trkpt":
+                columns.addPoint(value)
+            elif tag == "trkseg":
+                columns.startSegment()
+            elif tag == "trk":
+                columns = _ColumnBuilder()  # as for Track, the last one wins
+        return columns.build(cls)
+
+    @classmethod
+    def _fromTrackSegs(cls, listOfPointLists):
+        """ Creates a TrackArray from a list of lists of TrackPoint. """
+        columns = _ColumnBuilder()
+        for pointList in listOfPointLists:
+            columns.startSegment()
+            for trackPoint in pointList:
+                columns.addPoint(trackPoint)
+        return columns.build(cls)
+
+    def _computeDerivedColumns(self):
+        """ Computes accumulatedDistance, accumulatedElevation and speed.
+
+        Same definitions as the corresponding methods of Track: consecutive
+        points are paired across segment boundaries too, and the speed of
+        the first point is that of the second point. The speed is NaN at
+        every point when it is undefined (fewer than 2 points, or two
+        consecutive points with the same time).
+        """
+        n = len(self.lat)
+        (self.accumulatedDistance, self.accumulatedElevation, speed) = \
+          kernels.derivedMetrics(self.lat, self.lon, self.elevation,
+                                 self.elapsedTime if n > 1 else None)
+        self.speed = speed if speed is not None else numpy.full(n, numpy.nan)
+
+    def __len__(self):
+        """ Returns the number of track points of self """
+        return len(self.lat)
+
+    def getSegmentCount(self):
+        """ Returns the number of track segments of self """
+        return len(self.segmentOffsets) - 1
+
+    def _timeAt(self, index):
+        """ Returns a Time object for the track point at the given index """
+        elapsed = self.elapsedTime[index]
+        if numpy.isnan(elapsed):
+            return None
+        return Time.fromEpochMicroseconds(
+          self.startEpochMicroseconds + int(round(elapsed * 1000000)))
+
+    def _trackPointAt(self, index):
+        """ Returns a new TrackPoint with the data at the given index """
+        trackPoint = TrackPoint(float(self.lat[index]),
+                                float(self.lon[index]),
+                                self._timeAt(index),
+                                float(self.elevation[index]))
+        trackPoint.setAccumulatedDistance(
+          float(self.accumulatedDistance[index]))
+        trackPoint.setAccumulatedElevation(
+          float(self.accumulatedElevation[index]))
+        trackPoint.setSpeed(float(self.speed[index]))
+        return trackPoint
+
+    def getStartTime(self):
+        """ Returns the starting time of self, in the form of a Time object. """
+        return self._timeAt(0)
+
+    def getFinishTime(self):
+        """ Returns the finishing time of self, in the form of a Time object."""
+        return self._timeAt(-1)
+
+    def produceSeries(self, arrangeAs = "time series", dataKind = "pace"):
+        """ Produces a series with data from self, to use in further processing.
+
+        Same contract as Track.produceSeries().
+        Requires:
+          arrangeAs = "time series" or "distance series";
+          dataKind = "pace" or "speed km/h" or "elevation".
+        Ensures: a list of (x,y) pairs of float.
+        """
+        # maximum allowed pace (a kind of constant):
+        MAXIMUM_PACE = 60.0
+        # this implies that the minimum allowed speed is...
+        MINIMUM_SPEED = 100 / (6 * MAXIMUM_PACE)
+        if arrangeAs == "time series":
+            x = self.elapsedTime - self.elapsedTime[0]
+        else:  # arrangeAs == "distance series"
+            x = self.accumulatedDistance
+        if dataKind == "pace":
+            with numpy.errstate(divide = "ignore"):
+                y = numpy.where(self.speed > MINIMUM_SPEED,
+                                (1/self.speed) * 100/6, MAXIMUM_PACE)
+        elif dataKind == "speed km/h":
+            y = self.speed * 36/10
+        else:  # dataKind == "elevation"
+            y = self.elevation
+        return list(zip(x.tolist(), y.tolist()))
+
+    def produceXYdata(self):
+        """ Produces a list of (longitude, latitude) pairs from self.
+
+        Same contract as Track.produceXYdata().
+        """
+        return list(zip(self.lon.tolist(), self.lat.tolist()))
+
+    def getSerialized(self):
+        """ Returns the track points of self in a simple list.
+
+        The TrackPoint objects are created on each call, with all of their
+        computed attributes initialized.
+        Ensures:
+          a list containing the track points of self;
+          each track point has its accumulatedDistance attribute initialized.
+        """
+        return [self._trackPointAt(i) for i in range(len(self))]
+
+    def toTrack(self):
+        """ Returns a Track (made of TrackPoint objects) equivalent to self """
+        track = Track()
+        for k in range(self.getSegmentCount()):
+            trackSegment = TrackSeg()
+            for i in range(self.segmentOffsets[k], self.segmentOffsets[k+1]):
+                trackSegment.addPoint(self._trackPointAt(i))
+            track.addTrackSeg(trackSegment)
+        return track
+
+    def hidePartOfTrack(self, center_lat, center_lon, radius):
+        """ Returns a new TrackArray resulting from deleting points from self.
+
+        Same contract as Track.hidePartOfTrack(): deletes the points within
+        radius meters of (center_lat, center_lon) and does not keep any
+        track segment which ends up with less than 2 track points.
+        """
+        return self.hidePartsOfTrack([(center_lat, center_lon, radius)])
+
+    def hidePartsOfTrack(self, listOfZones):
+        """ Returns a new TrackArray without the points in any of some zones.
+
+        Same contract as Track.hidePartsOfTrack().
+        """
+        hidden = numpy.asarray(
+          kernels.pointsInZones(self.lat, self.lon, listOfZones), dtype = bool)
+        return self._subset(~hidden)
+
+    def _subset(self, keep):
+        """ Returns a new TrackArray with the points where keep is True.
+
+        Does not keep any track segment which ends up with less than
+        2 track points.
+        Requires: keep is a numpy array of bool with one entry per point.
+        """
+        selected = []
+        segmentOffsets = [0]
+        for k in range(self.getSegmentCount()):
+            first = self.segmentOffsets[k]
+            indices = numpy.flatnonzero(keep[first:self.segmentOffsets[k+1]])
+            if len(indices) > 1:
+                selected.append(indices + first)
+                segmentOffsets.append(segmentOffsets[-1] + len(indices))
+        if selected:
+            selected = numpy.concatenate(selected)
+        else:
+            selected = numpy.zeros(0, dtype = numpy.int64)
+        elapsedTime = self.elapsedTime[selected]
+        startEpochMicroseconds = self.startEpochMicroseconds
+        if len(selected) > 0 and startEpochMicroseconds is not None \
+           and not numpy.isnan(elapsedTime[0]):
+            # keep the first remaining point as time reference
+            shift = int(round(elapsedTime[0] * 1000000))
+            startEpochMicroseconds += shift
+            elapsedTime = elapsedTime - shift / 1000000
+        return TrackArray(self.lat[selected], self.lon[selected],
+                          self.elevation[selected], elapsedTime,
+                          startEpochMicroseconds, segmentOffsets)
+
+    def getRangeIndex(self):
+        """ Returns a RangeIndex over the columns of self (see Track).
+
+        The index is built on the first call only, since self is not
+        modified after creation.
+        """
+        if self._rangeIndex is None:
+            self._rangeIndex = RangeIndex(self.accumulatedDistance.tolist(),
+                                          self.accumulatedElevation.tolist(),
+                                          self.elapsedTime.tolist(),
+                                          self.speed.tolist())
+        return self._rangeIndex
+
+    def totalTime(self):
+        """ Returns the total time of this track, in seconds. """
+        return float(self.elapsedTime[-1] - self.elapsedTime[0])
+
+    def totalDistance(self):
+        """ Returns the total accumulated distance of this track. """
+        return float(self.accumulatedDistance[-1])
+
+    def totalAccumulatedElevation(self):
+        """ Returns the total accumulated positive elevation of this track. """
+        return float(self.accumulatedElevation[-1])
+
+    def averageSpeed(self, expressAs = "pace"):
+        """ Returns the average speed of this track.
+
+        Same contract as Track.averageSpeed().
+        """
+        averageSpeedMetersPerSecond = self.totalDistance()/self.totalTime()
+        if expressAs == "pace":
+            result = (1/averageSpeedMetersPerSecond) * 100/6
+        else:  # expressAs = "speed km/h"
+            result = averageSpeedMetersPerSecond * 36/10
+        return result
+
+
+class _ColumnBuilder:
+    """ Accumulates track points into growable float64 columns. """
+
+    def __init__(self):
+        self.lat = array('d')
+        self.lon = array('d')
+        self.elevation = array('d')
+        self.elapsedTime = array('d')
+        self.startEpochMicroseconds = None
+        self.segmentOffsets = [0]
+
+    def startSegment(self):
+        self.segmentOffsets.append(self.segmentOffsets[-1])
+
+    def addPoint(self, trackPoint):
+        self.lat.append(trackPoint.getLatitude())
+        self.lon.append(trackPoint.getLongitude())
+        self.elevation.append(trackPoint.getElevation())
+        epochMicroseconds = trackPoint.getEpochMicroseconds()
+        if epochMicroseconds is None:
+            self.elapsedTime.append(numpy.nan)
+        else:
+            if self.startEpochMicroseconds is None:
+                self.startEpochMicroseconds = epochMicroseconds
+            self.elapsedTime.append(
+              (epochMicroseconds - self.startEpochMicroseconds) / 1000000)
+        self.segmentOffsets[-1] += 1
+
+    def build(self, cls):
+        """ Returns a new instance of cls (TrackArray) with the columns """
+        return cls(numpy.frombuffer(self.lat), numpy.frombuffer(self.lon),
+                   numpy.frombuffer(self.elevation),
+                   numpy.frombuffer(self.elapsedTime),
+                   self.startEpochMicroseconds, self.segmentOffsets)
@@ -0,0 +1,343 @@
+# module trackcache
+
+""" On-disk cache of parsed GPX files, so that repeated loads skip the XML.
+
+For each GPX file, a cache file holds the parsed data of its track (as
+columns: coordinates, elevation, times, segment boundaries), the derived
+columns (accumulated distance, accumulated elevation, speed), and its
+waypoints and route. The columns are stored as raw binary arrays, and are
+read directly into arrays, without parsing them.
+A cache never prevents loading: if the cache file cannot be written (e.g.
+the cache directory is read-only), the GPX file is loaded as parsed.
+
+A cache file is only used if it was written with the current
+CACHE_FORMAT_VERSION, GPXparser.PARSER_VERSION and
+kernels.DISTANCE_MODEL_VERSION, and for the current state of the GPX file
+(same size and modification time, or same content hash); otherwise it is
+rebuilt. Cache files are replaced atomically, so a concurrent reader never
+sees a partially written file.
+
+File layout:
+  8 bytes: the magic string MAGIC;
+  4 bytes: n, the length of the header (unsigned, little-endian);
+  n bytes: the header, in JSON (versions, source file key, waypoints,
+    route, segment offsets and the position of each column);
+  the columns, each aligned to 8 bytes, in native byte order.
+"""
+
+from array import array
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+
+import GPXparser
+import kernels
+import myPyGPX
+
+MAGIC = b"GPXTRKC\0"
+
+# must be incremented whenever the layout of the cache files changes
+CACHE_FORMAT_VERSION = 1
+
+# stands for a track point without time in the column of times
+NO_TIME = -2**63
+
+# (name, array typecode) of each column, in file order
+COLUMNS = [("lat", "d"), ("lon", "d"), ("elevation", "d"),
+           ("epochMicroseconds", "q"), ("accumulatedDistance", "d"),
+           ("accumulatedElevation", "d"), ("speed", "d")]
+
+
+def getCacheFileName(gpxFileName, cacheDirectory):
+    """ Returns the name of the cache file of a GPX file.
+
+    Requires: gpxFileName and cacheDirectory are strings.
+    """
+    pathHash = hashlib.sha1(
+      os.path.abspath(gpxFileName).encode("utf-8")).hexdigest()
+    return os.path.join(cacheDirectory, pathHash + ".trkc")
+
+
+def _getSourceKey(gpxFileName, validateBy):
+    """ Returns what identifies the current state of a GPX file.
+
+    Requires: validateBy = "stat" (size and modification time) or
+      "content" (SHA-256 of the content of the file).
+    """
+    if validateBy == "stat":
+        status = os.stat(gpxFileName)
+        return {"path": os.path.abspath(gpxFileName),
+                "size": status.st_size, "mtime": status.st_mtime_ns}
+    contentHash = hashlib.sha256()
+    with open(gpxFileName, "rb") as gpxFile:
+        for block in iter(lambda: gpxFile.read(1 << 20), b""):
+            contentHash.update(block)
+    return {"sha256": contentHash.hexdigest()}
+
+
+def _getVersions():
+    """ Returns the versions a cache file must have been written with """
+    return {"format": CACHE_FORMAT_VERSION,
+            "parser": GPXparser.PARSER_VERSION,
+            "distanceModel": kernels.DISTANCE_MODEL_VERSION,
+            "byteorder": sys.byteorder}
+
+
+def _getColumns(someGPXDocument):
+    """ Returns the data of a GPXDocument, as held in its cache file.
+
+    Requires: as writeCache().
+    Ensures: a pair (header, columns) as returned by readCache(), except
+      that header holds neither the versions, nor the source file key, nor
+      the position of each column.
+    """
+    columns = dict((name, array(typecode)) for (name, typecode) in COLUMNS)
+    segmentOffsets = [0]
+    track = someGPXDocument.getTrack()
+    if track is not None:
+        for trackSegment in track.trackSegList:
+            for trackPoint in trackSegment.getPointList():
+                columns["lat"].append(trackPoint.getLatitude())
+                columns["lon"].append(trackPoint.getLongitude())
+                columns["elevation"].append(trackPoint.getElevation())
+                epochMicroseconds = trackPoint.getEpochMicroseconds()
+                columns["epochMicroseconds"].append(
+                  NO_TIME if epochMicroseconds is None else epochMicroseconds)
+            segmentOffsets.append(len(columns["lat"]))
+        if segmentOffsets[-1] > 0:
+            # computes all three derived attributes, if possible; the values
+            # of track are read from its memo (see Track._ensureComputed())
+            columns["accumulatedDistance"].extend(
+              track._getDerivedAttribute("accumulatedDistance"))
+            columns["accumulatedElevation"].extend(
+              track._getDerivedAttribute("accumulatedElevation"))
+            if "speed" in track._getMemo():
+                columns["speed"].extend(track._getDerivedAttribute("speed"))
+            else:
+                columns["speed"].extend([float("nan")] * segmentOffsets[-1])
+    route = someGPXDocument.getRoute()
+    if route is not None:
+        route = [[point.lat, point.lon, point.elevation, point.name,
+                  point.description] for point in route.getPointList()]
+    header = {"hasTrack": track is not None,
+              "segmentOffsets": segmentOffsets,
+              "waypoints": [[point.lat, point.lon, point.elevation, point.name,
+                             point.description]
+                            for point in someGPXDocument.getWayPoints()],
+              "route": route}
+    return (header, columns)
+
+
+def writeCache(someGPXDocument, cacheFileName, sourceKey):
+    """ Writes the cache file of a GPXDocument.
+
+    Requires:
+      someGPXDocument is a GPXDocument, whose track (if any) has at least
+      1 track point;
+      sourceKey identifies the GPX file (see _getSourceKey()).
+    Ensures: the cache file is created or replaced atomically; OSError is
+      raised if it cannot be written.
+    """
+    _writeColumns(*_getColumns(someGPXDocument), cacheFileName, sourceKey)
+
+
+def _writeColumns(header, columns, cacheFileName, sourceKey):
+    """ Writes a cache file with the result of _getColumns() """
+    header = dict(header, versions = _getVersions(), source = sourceKey,
+                  columns = {})
+    # the position of each column depends on the length of the header, which
+    # depends on the positions: reserve enough digits for them
+    numberOfBytes = sum(len(columns[name]) * columns[name].itemsize
+                        for (name, typecode) in COLUMNS)
+    for (name, typecode) in COLUMNS:
+        header["columns"][name] = 10**(len(str(numberOfBytes)) + 8)
+    headerLength = len(json.dumps(header).encode("utf-8"))
+    offset = len(MAGIC) + 4 + headerLength
+    for (name, typecode) in COLUMNS:
+        offset += -offset % 8
+        header["columns"][name] = offset
+        offset += len(columns[name]) * columns[name].itemsize
+    headerBytes = json.dumps(header).encode("utf-8")
+    headerBytes += b" " * (headerLength - len(headerBytes))
+    cacheDirectory = os.path.dirname(cacheFileName) or "."
+    os.makedirs(cacheDirectory, exist_ok = True)
+    (fileDescriptor, temporaryName) = tempfile.mkstemp(dir = cacheDirectory)
+    try:
+        with os.fdopen(fileDescriptor, "wb") as cacheFile:
+            cacheFile.write(MAGIC)
+            cacheFile.write(struct.pack("<I", headerLength))
+            cacheFile.write(headerBytes)
+            for (name, typecode) in COLUMNS:
+                cacheFile.write(b"\0" * (header["columns"][name] -
+                                         cacheFile.tell()))
+                columns[name].tofile(cacheFile)
+        os.replace(temporaryName, cacheFileName)
+    except BaseException:
+        os.remove(temporaryName)
+        raise
+
+
+def readCache(cacheFileName, sourceKey):
+    """ Reads a cache file, if it is valid.
+
+    The columns are read directly into arrays, without parsing them.
+    Requires: sourceKey identifies the GPX file (see _getSourceKey()).
+    Ensures:
+      None if the file does not exist, cannot be read, or was written with
+      other versions or for another state of the GPX file;
+      otherwise, a pair (header, columns) where header is the dict read from
+      the file and columns maps each column name to an array read from the
+      file.
+    """
+    try:
+        with open(cacheFileName, "rb") as cacheFile:
+            if cacheFile.read(len(MAGIC)) != MAGIC:
+                return None
+            (headerLength,) = struct.unpack("<I", cacheFile.read(4))
+            header = json.loads(cacheFile.read(headerLength).decode("utf-8"))
+            if header["versions"] != _getVersions() \
+               or header["source"] != sourceKey:
+                return None
+            numberOfPoints = header["segmentOffsets"][-1]
+            columns = {}
+            for (name, typecode) in COLUMNS:
+                column = array(typecode)
+                cacheFile.seek(header["columns"][name])
+                column.fromfile(cacheFile, numberOfPoints)
+                columns[name] = column
+        return (header, columns)
+    except (OSError, EOFError, ValueError, KeyError, TypeError,
+            struct.error):
+        return None
+
+
+def _getValidCache(gpxFileName, cacheDirectory, validateBy):
+    """ Returns readCache() of the cache file, after (re)writing it if needed.
+
+    A cache never prevents loading: if the cache file cannot be written,
+    the data of the GPX file just parsed is returned (as by readCache()).
+    """
+    cacheFileName = getCacheFileName(gpxFileName, cacheDirectory)
+    sourceKey = _getSourceKey(gpxFileName, validateBy)
+    cache = readCache(cacheFileName, sourceKey)
+    if cache is None:
+        someGPXDocument = myPyGPX.GPXDocument.__new__(myPyGPX.GPXDocument)
+        someGPXDocument.fileName = gpxFileName
+        someGPXDocument.currentTrack = None
+        someGPXDocument.currentRoute = None
+        someGPXDocument.currentWayPoints = []
+        GPXparser.buildGPXDocument(gpxFileName, someGPXDocument)
+        cache = _getColumns(someGPXDocument)
+        try:
+            _writeColumns(*cache, cacheFileName, sourceKey)
+        except OSError:  # e.g. read-only or invalid cache directory
+            pass
+    return cache
+
+
+def buildGPXDocument(gpxFileName, someGPXDocument, cacheDirectory,
+                     validateBy = "stat", parseProfile = "full"):
+    """ Initializes a GPXDocument object from the cache of a GPX file.
+
+    Drop-in replacement for GPXparser.buildGPXDocument(): the GPX file is
+    only parsed (and the cache file written) if there is no valid cache file.
+    The derived attributes of the track points (accumulatedDistance,
+    accumulatedElevation and speed) are read from the cache as well.
+    The cache file holds every field; those not in parseProfile are left
+    out, with the derived attributes that depend on them, as
+    GPXparser.buildGPXDocument() would do.
+    Requires:
+      as GPXparser.buildGPXDocument();
+      cacheDirectory is the name of a directory (created if needed);
+      validateBy = "stat" or "content" (see the module docstring).
+    """
+    fields = GPXparser.getProfileFields(parseProfile)
+    (header, columns) = _getValidCache(gpxFileName, cacheDirectory, validateBy)
+    if header["hasTrack"]:
+        track = myPyGPX.Track()
+        hasSpeed = True
+        segmentOffsets = header["segmentOffsets"]
+        # as lists, so that reading each value is cheap
+        (lat, lon, elevation, epochMicroseconds, accumulatedDistance,
+         accumulatedElevation, speed) = [columns[name].tolist()
+                                         for (name, typecode) in COLUMNS]
+        numberOfPoints = segmentOffsets[-1]
+        if "elevation" not in fields:  # as if absent: no ascent either
+            elevation = [0] * numberOfPoints
+            accumulatedElevation = [0.0] * numberOfPoints
+        if "time" not in fields:  # as if absent: no speed either
+            epochMicroseconds = [NO_TIME] * numberOfPoints
+            speed = [float("nan")] * numberOfPoints
+        for k in range(len(segmentOffsets) - 1):
+            trackSegment = myPyGPX.TrackSeg()
+            for i in range(segmentOffsets[k], segmentOffsets[k+1]):
+                # no Time object is made (see TrackPoint.getTime())
+                trackPoint = myPyGPX.TrackPoint.fromEpochMicroseconds(
+                  lat[i], lon[i], epochMicroseconds[i]
+                  if epochMicroseconds[i] != NO_TIME else None, elevation[i])
+                trackPoint.setAccumulatedDistance(accumulatedDistance[i])
+                trackPoint.setAccumulatedElevation(accumulatedElevation[i])
+                if speed[i] != speed[i]:  # NaN: not computed
+                    hasSpeed = False
+                else:
+                    trackPoint.setSpeed(speed[i])
+                trackSegment.addPoint(trackPoint)
+            track.addTrackSeg(trackSegment)
+        if segmentOffsets[-1] > 0:
+            # the derived attributes are already set
+            memo = track._getMemo()
+            memo["derivedAttributesTried"] = True
+            memo["accumulatedDistance"] = accumulatedDistance
+            memo["accumulatedElevation"] = accumulatedElevation
+            if hasSpeed:
+                memo["speed"] = speed
+        someGPXDocument.setTrack(track)
+    def _pointFields(lat, lon, ele, name, description):
+        """ Returns the arguments of RoutePoint for parseProfile """
+        return (lat, lon, ele if "elevation" in fields else 0,
+                name if "name" in fields else "",
+                description if "description" in fields else "")
+    if header["route"] is not None:
+        route = myPyGPX.Route()
+        for point in header["route"]:
+            route.addPoint(myPyGPX.RoutePoint(*_pointFields(*point)))
+        someGPXDocument.setRoute(route)
+    someGPXDocument.setWayPoints(
+      [myPyGPX.WayPoint(*_pointFields(*point))
+       for point in header["waypoints"]])
+
+
+def loadTrackArray(gpxFileName, cacheDirectory, validateBy = "stat"):
+    """ Returns the track of a GPX file as a TrackArray, through the cache.
+
+    The columns of the TrackArray share the memory of the arrays read from
+    the cache file, so a load with a valid cache file takes little more than
+    reading it.
+    Requires:
+      gpxFileName names a GPX file with a track of at least 1 track point;
+      cacheDirectory and validateBy as for buildGPXDocument();
+      NumPy is available.
+    """
+    import numpy
+    from trackarray import TrackArray
+    (header, columns) = _getValidCache(gpxFileName, cacheDirectory, validateBy)
+    def _column(name):
+        return numpy.frombuffer(columns[name], dtype = numpy.float64)
+    epochMicroseconds = numpy.frombuffer(columns["epochMicroseconds"],
+                                         dtype = numpy.int64)
+    hasTime = epochMicroseconds != NO_TIME
+    startEpochMicroseconds = None
+    elapsedTime = numpy.full(len(epochMicroseconds), numpy.nan)
+    if hasTime.any():
+        startEpochMicroseconds = int(epochMicroseconds[hasTime][0])
+        elapsedTime[hasTime] = \
+          (epochMicroseconds[hasTime] - startEpochMicroseconds) / 1000000
+    return TrackArray(_column("lat"), _column("lon"), _column("elevation"),
+                      elapsedTime, startEpochMicroseconds,
+                      header["segmentOffsets"],
+                      derivedColumns = (_column("accumulatedDistance"),
+                                        _column("accumulatedElevation"),
+                                        _column("speed")))